@@ -0,0 +1,12 @@
+import sys
+from website import create_app
+from website.archive import archive_events, RETENTION_DAYS
+
+# Move finished events older than the retention window (default 90 days, or pass a number of days)
+# to the archive tables, along with their orders and comments
+if __name__ == '__main__':
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else RETENTION_DAYS
+    app = create_app()
+    with app.app_context():
+        archived = archive_events(retention_days=days)
+    print(f'Archived {archived} events that ended more than {days} days ago')
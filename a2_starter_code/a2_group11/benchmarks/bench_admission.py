@@ -0,0 +1,63 @@
+"""
+Waiting room: queue positions, and purchase latency for admitted buyers as the queue
+behind them grows 100x (in-memory admission store).
+
+    python -m benchmarks.bench_admission
+"""
+import statistics
+import time
+from .common import make_app, add_user, add_event, login
+
+QUEUE_SIZES = (100, 1000, 10000)
+PURCHASES = 50
+
+def check_positions(app):
+    from website.admission import MemoryAdmissionStore
+    store = MemoryAdmissionStore(max_active=1, active_seconds=60, queue_timeout=60)
+    store.enter(1, 'buying')
+    store.enter(1, 'first')
+    # Buyers queueing for other events must not move anyone's place for event 1
+    for i in range(5):
+        store.enter(2, f'other{i}')
+    position = store.enter(1, 'second')
+    assert position == 2, position
+    print('Queue positions are counted per event')
+
+def main():
+    app = make_app()
+    check_positions(app)
+    from website import db
+    from website.admission import admission_store
+    with app.app_context():
+        buyer = add_user()
+        event = add_event(buyer, total_tickets=1000000)
+        event_id, buyer_id = event.id, buyer.id
+        store = admission_store()
+        # Admitted first, so the buyer is purchasing while everyone else waits
+        assert store.enter(event_id, buyer_id) == 0
+    client = app.test_client()
+    login(client, buyer_id)
+
+    queued = 0
+    results = []
+    for size in QUEUE_SIZES:
+        start = time.perf_counter()
+        while queued < size:
+            queued += 1
+            store.enter(event_id, f'waiting-{queued}')
+        per_arrival = (time.perf_counter() - start) / (size - (results[-1][0] if results else 0))
+        timings = []
+        for i in range(PURCHASES):
+            start = time.perf_counter()
+            response = client.post(f'/events/{event_id}/purchase',
+                                   data={'tickets_purchased': 1, 'idempotency_key': f'{size}-{i}'})
+            timings.append(time.perf_counter() - start)
+            assert response.status_code == 302 and '/reservations/' in response.location, response.location
+        results.append((size, statistics.median(timings)))
+        print(f'{size:>6} queued: arrival {per_arrival * 1e6:.1f}us, purchase median {statistics.median(timings) * 1000:.1f}ms')
+    ratio = results[-1][1] / results[0][1]
+    print(f'Purchase latency at {QUEUE_SIZES[-1]} vs {QUEUE_SIZES[0]} queued: {ratio:.2f}x')
+    assert ratio < 2, 'purchase latency grew with the queue'
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Archiving: listing and order queries before and after old events are archived, and a
+check that nothing is left pointing at archived rows.
+
+    python -m benchmarks.bench_archive [events]
+"""
+from datetime import datetime, timedelta
+import random
+import sys
+import time
+from .common import make_app, add_user
+
+def add_history(creator, count):
+    """count events over the last two years, mostly finished, each with one order and a job."""
+    from website import db
+    from website.models import Event, EventCategory, EventStatus, Order, Job, JobStatus, DeadJob
+    random.seed(1)
+    now = datetime.now()
+    for offset in range(0, count, 50000):
+        events = []
+        for i in range(offset, min(offset + 50000, count)):
+            start = now - timedelta(days=random.uniform(-30, 700))
+            end = start + timedelta(hours=6)
+            events.append(dict(
+                id=i + 1, title=f'Event {i}', start_time=start, end_time=end, venue='1 Bench St',
+                total_tickets=100, ticket_price=10, category_type=EventCategory.FOOD,
+                status=ended_status(end, now, i), status_date=now,
+                free_sampling=False, provide_takeaway=False, tickets_sold=1, comments_count=0,
+                revenue=10, version=1, creator_id=creator.id
+            ))
+        db.session.execute(db.insert(Event), events)
+        orders = [dict(id=e['id'], tickets_purchased=1, purchased_amount=10, booking_time=now,
+                       user_id=creator.id, event_id=e['id']) for e in events]
+        db.session.execute(db.insert(Order), orders)
+        # Every tenth confirmation failed every retry
+        jobs = [dict(id=o['id'], name='order_confirmation', idempotency_key=f"order_confirmation:{o['id']}",
+                     status=JobStatus.DEAD if o['id'] % 10 == 0 else JobStatus.DONE, attempts=1,
+                     run_at=now, created_at=now, order_id=o['id']) for o in orders]
+        db.session.execute(db.insert(Job), jobs)
+        dead = [dict(job_id=j['id'], name=j['name'], idempotency_key=j['idempotency_key'], attempts=5,
+                     error='failed', failed_at=now) for j in jobs if j['status'] == JobStatus.DEAD]
+        db.session.execute(db.insert(DeadJob), dead)
+        db.session.commit()
+
+def ended_status(end, now, i):
+    """Open until the event ends; afterwards every fifth event stays sold out."""
+    from website.models import EventStatus
+    if end > now:
+        return EventStatus.OPEN
+    return EventStatus.SOLDOUT if i % 5 == 0 else EventStatus.INACTIVE
+
+def time_queries():
+    """The home page's event listing, and counting orders joined to their events."""
+    from website import db
+    from website.models import Event, Order
+    start = time.perf_counter()
+    db.session.scalars(db.select(Event).order_by(Event.start_time)).all()
+    db.session.scalar(db.select(db.func.count(Order.id)).join(Event, Event.id == Order.event_id))
+    elapsed = time.perf_counter() - start
+    db.session.expunge_all()
+    return elapsed
+
+def main(count):
+    app = make_app()
+    from website import db
+    from website.archive import archive_events, RETENTION_DAYS
+    from website.models import Event, EventStatus, Order, Job, DeadJob
+    with app.app_context():
+        add_history(add_user(), count)
+        before = time_queries()
+        start = time.perf_counter()
+        archived = archive_events()
+        archiving = time.perf_counter() - start
+        after = time_queries()
+        print(f'{count} events, {archived} archived in {archiving:.1f}s')
+        print(f'  listing + order join: {before * 1000:.0f}ms before, {after * 1000:.0f}ms after')
+
+        orphan_jobs = db.session.scalar(
+            db.select(db.func.count(Job.id)).where(~Job.order_id.in_(db.select(Order.id))))
+        orphan_dead = db.session.scalar(
+            db.select(db.func.count(DeadJob.id)).where(~DeadJob.job_id.in_(db.select(Job.id))))
+        assert orphan_jobs == 0 and orphan_dead == 0, (orphan_jobs, orphan_dead)
+        print('  no jobs or dead letters left pointing at archived orders')
+
+        cutoff = datetime.now() - timedelta(days=RETENTION_DAYS)
+        sold_out = db.session.scalar(db.select(db.func.count(Event.id)).where(
+            Event.status == EventStatus.SOLDOUT, Event.end_time < cutoff))
+        assert sold_out == 0, sold_out
+        print('  sold out events that ended were archived too')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
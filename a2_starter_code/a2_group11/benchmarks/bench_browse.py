@@ -0,0 +1,71 @@
+"""
+Browse page latency, measured end to end through the test client.
+
+    python -m benchmarks.bench_browse [events]
+"""
+from datetime import datetime, timedelta
+import random
+import statistics
+import sys
+import time
+from .common import make_app, add_user
+
+REQUESTS = 20
+URLS = (
+    '/browse',
+    '/browse?category=Food&status=Open',
+    '/browse?category=Drink&free_sampling=1&min_price=5&max_price=20&page=3',
+    '/browse?sort=popular',
+)
+
+def add_events(creator, count):
+    """Bulk insert count events spread over a year either side of today."""
+    from website import db
+    from website.models import Event, EventCategory, EventStatus
+    random.seed(1)
+    now = datetime.now()
+    categories = list(EventCategory)
+    for offset in range(0, count, 50000):
+        rows = []
+        for i in range(offset, min(offset + 50000, count)):
+            start = now + timedelta(days=random.uniform(-365, 365))
+            rows.append(dict(
+                title=f'Event {i}', start_time=start, end_time=start + timedelta(hours=random.randint(2, 72)),
+                venue='1 Bench St', total_tickets=random.randint(0, 500), ticket_price=random.randint(0, 50),
+                category_type=random.choice(categories), status=EventStatus.OPEN, status_date=now,
+                free_sampling=random.random() < 0.5, provide_takeaway=random.random() < 0.5,
+                tickets_sold=random.randint(0, 500), comments_count=random.randint(0, 50),
+                revenue=0, version=1, creator_id=creator.id
+            ))
+        db.session.execute(db.insert(Event), rows)
+        db.session.commit()
+
+def time_get(client, url):
+    start = time.perf_counter()
+    response = client.get(url)
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200, (url, response.status_code)
+    return elapsed
+
+def main(count):
+    app = make_app()
+    from website import browse
+    from website.events import expire_finished_events
+    with app.app_context():
+        add_events(add_user(), count)
+        # Every event was inserted OPEN, so the first run marks about half as over
+        start = time.perf_counter()
+        expire_finished_events()
+        print(f'{count} events, first expire_finished_events() {(time.perf_counter() - start) * 1000:.0f}ms')
+        start = time.perf_counter()
+        expire_finished_events()
+        print(f'  with nothing left to expire {(time.perf_counter() - start) * 1000:.2f}ms')
+    client = app.test_client()
+    for url in URLS:
+        browse.facet_cache.clear()
+        cold = time_get(client, url)
+        warm = statistics.median(time_get(client, url) for _ in range(REQUESTS))
+        print(f'  GET {url}: first {cold * 1000:.0f}ms, then median {warm * 1000:.1f}ms')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,69 @@
+"""
+Comment throughput: one INSERT and commit per comment, as posting a comment used to do,
+against the background CommentBatcher. Also checks the rendered comment list cache
+stays bounded.
+
+    python -m benchmarks.bench_comments [comments]
+"""
+import sys
+import time
+from .common import make_app, add_user, add_event
+
+def unbatched(event_id, user_id, count):
+    """Save each comment and bump its event's counter in its own transaction."""
+    from website import db
+    from website.models import Comment, Event
+    start = time.perf_counter()
+    for i in range(count):
+        db.session.add(Comment(event_id=event_id, user_id=user_id, contents=f'Comment {i}'))
+        db.session.execute(
+            db.update(Event)
+            .where(Event.id == event_id)
+            .values(comments_count=Event.comments_count + 1, version=Event.version + 1)
+        )
+        db.session.commit()
+    return time.perf_counter() - start
+
+def batched(app, event_id, user_id, count):
+    """Queue every comment and wait until the batcher's thread has saved them all."""
+    from website import db
+    from website.comments import CommentBatcher
+    from website.models import Event
+    batcher = CommentBatcher(app)
+    start = time.perf_counter()
+    for i in range(count):
+        batcher.submit(event_id, user_id, f'Comment {i}')
+    while db.session.scalar(db.select(Event.comments_count).where(Event.id == event_id)) < count:
+        db.session.rollback()
+        time.sleep(0.01)
+    return time.perf_counter() - start
+
+def check_fragment_cache(app, creator):
+    from website.comments import CommentBatcher
+    batcher = CommentBatcher(app, max_fragments=10)
+    events = [add_event(creator, title=f'Cache {i}') for i in range(20)]
+    for event in events:
+        batcher.comment_fragment(event)
+    assert list(batcher.fragments) == [event.id for event in events[-10:]], list(batcher.fragments)
+    print('Rendered comment lists are capped, least recently used dropped first')
+
+def main(count):
+    app = make_app()
+    with app.app_context():
+        user = add_user()
+        slow, fast = add_event(user, title='Unbatched'), add_event(user, title='Batched')
+        user_id, slow_id, fast_id = user.id, slow.id, fast.id
+
+        elapsed = unbatched(slow_id, user_id, count)
+        print(f'{count} comments unbatched in {elapsed:.2f}s: {count / elapsed:.0f} comments/s')
+        elapsed = batched(app, fast_id, user_id, count)
+        print(f'{count} comments batched in {elapsed:.2f}s: {count / elapsed:.0f} comments/s')
+
+        from website import db
+        from website.models import Comment
+        saved = db.session.scalar(db.select(db.func.count(Comment.id)).where(Comment.event_id == fast_id))
+        assert saved == count, saved
+        check_fragment_cache(app, user)
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,109 @@
+"""
+Cache invalidation across worker processes (sqlite backend): each worker caches an event,
+the main process keeps changing it, and every worker must drop its copy and reload the
+new version. Prints the delivery latency.
+
+    python -m benchmarks.bench_invalidation [workers] [changes]
+"""
+import logging
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+from .common import make_app, add_user, add_event
+
+def quiet_expected_failures():
+    # The failing subscriber and publish below are on purpose, their tracebacks are noise
+    logging.getLogger('website.invalidation').setLevel(logging.CRITICAL)
+
+def worker(database_url, event_id, results, ready):
+    quiet_expected_failures()
+    app = make_app(DATABASE_URL=database_url, INVALIDATION_BACKEND='sqlite')
+    from website import db
+    from website.models import Event
+    bus = app.extensions['invalidation_bus']
+    cache = {}
+
+    def cached_event():
+        if event_id not in cache:
+            with app.app_context():
+                event = db.session.get(Event, event_id)
+                cache[event_id] = (event.title, event.version)
+                db.session.remove()
+        return cache[event_id]
+
+    def on_event_changed(changed_id, version):
+        received = time.time()
+        if changed_id in (event_id, None):
+            cache.pop(event_id, None)
+            results.put((os.getpid(), received, version, cached_event()))
+
+    def broken_subscriber(changed_id, version):
+        raise RuntimeError('a failing subscriber must not stop delivery')
+
+    bus.subscribe('events', broken_subscriber)
+    bus.subscribe('events', on_event_changed)
+    cached_event()
+    bus.start()
+    ready.set()
+    time.sleep(600)
+
+def main(workers, changes):
+    quiet_expected_failures()
+    app = make_app(INVALIDATION_BACKEND='sqlite')
+    database_url = os.environ['DATABASE_URL']
+    from website import db
+    from website.models import Event
+    from website.invalidation import KEEP_MESSAGES
+    with app.app_context():
+        event_id = add_event(add_user()).id
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    readies = [context.Event() for _ in range(workers)]
+    processes = [context.Process(target=worker, args=(database_url, event_id, results, ready), daemon=True)
+                 for ready in readies]
+    for process in processes:
+        process.start()
+    for ready in readies:
+        assert ready.wait(60), 'worker did not start'
+
+    latencies = []
+    with app.app_context():
+        bus = app.extensions['invalidation_bus']
+        for i in range(changes):
+            if i == changes // 2:
+                # The job worker's pruning must not make workers miss later messages
+                backend = bus.backend
+                with db.engine.begin() as connection:
+                    connection.execute(db.update(backend.table).values(created_at=backend.table.c.created_at - KEEP_MESSAGES * 2))
+                backend.delete_old_messages()
+            event = db.session.get(Event, event_id)
+            event.title = f'Renamed {i}'
+            changed = time.time()
+            db.session.commit()
+            version = event.version
+            db.session.remove()
+            for _ in range(workers):
+                pid, received, message_version, (title, cached_version) = results.get(timeout=10)
+                assert message_version == version and (title, cached_version) == (f'Renamed {i}', version), \
+                    (pid, message_version, title, cached_version, version)
+                latencies.append(received - changed)
+
+        # A backend that cannot publish must not turn a committed write into an error
+        publish = bus.backend.publish
+        bus.backend.publish = lambda origin, messages: 1 / 0
+        event = db.session.get(Event, event_id)
+        event.title = 'Publish failed'
+        db.session.commit()
+        bus.backend.publish = publish
+        assert db.session.get(Event, event_id).title == 'Publish failed'
+
+    latencies.sort()
+    print(f'{workers} workers, {changes} changes: every worker reloaded every version')
+    print(f'  latency median {statistics.median(latencies) * 1000:.0f}ms, '
+          f'p95 {latencies[int(len(latencies) * 0.95)] * 1000:.0f}ms, max {latencies[-1] * 1000:.0f}ms')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 4, int(sys.argv[2]) if len(sys.argv) > 2 else 20)
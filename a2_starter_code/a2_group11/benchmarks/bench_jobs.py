@@ -0,0 +1,53 @@
+"""
+Job queue throughput, and recovery of jobs left RUNNING by a worker that died.
+
+    python -m benchmarks.bench_jobs [jobs]
+"""
+from datetime import datetime, timedelta
+import sys
+import time
+from .common import make_app, add_user, add_event
+
+def main(count):
+    app = make_app()
+    from website import db
+    from website.jobs import enqueue, run_pending, reclaim_expired_jobs, LEASE_SECONDS, MAX_ATTEMPTS
+    from website.models import Order, Job, JobStatus, DeadJob
+
+    with app.app_context():
+        user = add_user()
+        event = add_event(user)
+        orders = [Order(tickets_purchased=1, purchased_amount=10, user_id=user.id, event_id=event.id) for _ in range(count)]
+        db.session.add_all(orders)
+        db.session.flush()
+        for order in orders:
+            enqueue('order_confirmation', order)
+        db.session.commit()
+
+        start = time.perf_counter()
+        processed = 0
+        while True:
+            batch = run_pending()
+            if not batch:
+                break
+            processed += batch
+        elapsed = time.perf_counter() - start
+        done = db.session.scalar(db.select(db.func.count(Job.id)).where(Job.status == JobStatus.DONE))
+        assert processed == count and done == count, (processed, done)
+        print(f'{count} jobs in {elapsed:.2f}s: {count / elapsed:.0f} jobs/s')
+
+        # A worker died while running these: one with retries left, one on its last attempt
+        stale = datetime.now() - timedelta(seconds=LEASE_SECONDS + 1)
+        retry, last = Job.query.limit(2).all()
+        for job, attempts in ((retry, 0), (last, MAX_ATTEMPTS - 1)):
+            job.status, job.claimed_at, job.attempts = JobStatus.RUNNING, stale, attempts
+        db.session.commit()
+        assert reclaim_expired_jobs() == 2
+        db.session.expire_all()
+        assert retry.status == JobStatus.PENDING and retry.attempts == 1 and 'Lease expired' in retry.last_error
+        assert last.status == JobStatus.DEAD and db.session.scalar(db.select(DeadJob).where(DeadJob.job_id == last.id))
+        assert reclaim_expired_jobs() == 0
+        print('Expired RUNNING jobs were retried or dead-lettered')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
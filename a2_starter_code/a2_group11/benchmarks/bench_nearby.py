@@ -0,0 +1,61 @@
+"""
+"Events near me" latency, measured end to end through the test client.
+
+    python -m benchmarks.bench_nearby [events]
+"""
+from datetime import datetime, timedelta
+import random
+import statistics
+import sys
+import time
+from .common import make_app, add_user
+
+VENUES = 20000
+REQUESTS = 20
+# (km, days) searched around Sydney
+SEARCHES = ((10, 3), (50, 7), (200, 30))
+
+def add_events(creator, count):
+    """Bulk insert count events at random venues across eastern Australia, within 200 days of today."""
+    from website import db
+    from website.models import Event, EventCategory, EventStatus, Venue
+    random.seed(1)
+    venues = [Venue(name=f'Venue {i}', latitude=random.uniform(-44, -10), longitude=random.uniform(113, 154))
+              for i in range(VENUES)]
+    db.session.add_all(venues)
+    db.session.commit()
+    venue_ids = [venue.id for venue in venues]
+    now = datetime.now()
+    for offset in range(0, count, 50000):
+        rows = []
+        for i in range(offset, min(offset + 50000, count)):
+            start = now + timedelta(days=random.uniform(-200, 200))
+            rows.append(dict(
+                title=f'Event {i}', start_time=start, end_time=start + timedelta(hours=random.randint(2, 72)),
+                venue='Venue', venue_id=random.choice(venue_ids), total_tickets=10, ticket_price=5,
+                category_type=EventCategory.FOOD, status=EventStatus.OPEN, status_date=now,
+                free_sampling=False, provide_takeaway=False, tickets_sold=0, comments_count=0,
+                revenue=0, version=1, creator_id=creator.id
+            ))
+        db.session.execute(db.insert(Event), rows)
+        db.session.commit()
+
+def main(count):
+    app = make_app()
+    with app.app_context():
+        add_events(add_user(), count)
+    client = app.test_client()
+    print(f'{count} events')
+    for km, days in SEARCHES:
+        url = f'/nearby?lat=-33.87&lon=151.21&km={km}&days={days}'
+        timings = []
+        for _ in range(REQUESTS):
+            start = time.perf_counter()
+            response = client.get(url)
+            timings.append(time.perf_counter() - start)
+            assert response.status_code == 200
+        found = response.data.count(b'km away')
+        print(f'  GET {url}: {found} events, median {statistics.median(timings) * 1000:.1f}ms')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,111 @@
+"""
+Sessions: per-request time with Flask's cookie sessions and the memory and sqlite
+server-side stores, a check that requests which never use the session never load it,
+and a check that logging in and out moves the session to a new id.
+
+    python -m benchmarks.bench_sessions [requests]
+"""
+import statistics
+import sys
+import time
+from flask.sessions import SecureCookieSessionInterface
+from .common import make_app, add_user, add_event, login
+
+BACKENDS = ('cookie', 'memory', 'sqlite')
+
+def count_loads(store):
+    """Wrap store.load so calls to it are counted in the returned list."""
+    calls = []
+    load = store.load
+    def counted(sid):
+        calls.append(sid)
+        return load(sid)
+    store.load = counted
+    return calls
+
+def median_ms(client, url, count):
+    timings = []
+    for _ in range(count):
+        start = time.perf_counter()
+        response = client.get(url)
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, (url, response.status_code)
+    return statistics.median(timings) * 1000
+
+def time_backend(backend, count):
+    app = make_app(SESSION_BACKEND='memory' if backend == 'cookie' else backend)
+    if backend == 'cookie':
+        app.session_interface = SecureCookieSessionInterface()
+    with app.app_context():
+        user = add_user(f'{backend}@example.com')
+        event = add_event(user)
+        user_id, event_id = user.id, event.id
+    client = app.test_client()
+    login(client, user_id)
+
+    # Static files and public API calls never use the session
+    no_session = {
+        'static file': '/static/style/style.css',
+        'API event': f'/api/v1/events/{event_id}',
+        'API event list': '/api/v1/events',
+    }
+    loads = None if backend == 'cookie' else count_loads(app.session_interface.store)
+    timings = {label: median_ms(client, url, count) for label, url in no_session.items()}
+    if loads is not None:
+        assert not loads, f'{backend}: session loaded {len(loads)} times for requests that do not use it'
+    # The orders list looks up the logged in user, so reads the session every time
+    timings['API orders (logged in)'] = median_ms(client, '/api/v1/orders', count)
+    if loads is not None:
+        assert len(loads) == count, len(loads)
+    return app, user_id, timings
+
+def check_fixation(app, user_id):
+    """An id handed out before login must not be logged in afterwards, and logout must drop the id."""
+    from flask_bcrypt import generate_password_hash
+    from website import db
+    from website.models import User
+    store = app.session_interface.store
+    name = app.config['SESSION_COOKIE_NAME']
+    with app.app_context():
+        user = db.session.get(User, user_id)
+        user.password_hash = generate_password_hash('password')
+        db.session.commit()
+        email = user.email
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['visited'] = True
+        before = session.sid
+    response = client.post('/login', data={'email': email, 'password': 'password'})
+    assert response.status_code == 302, response.status_code
+    with client.session_transaction() as session:
+        after = session.sid
+        assert session['_user_id'] == str(user_id)
+    assert after != before and store.load(before) is None, 'login kept the session id'
+
+    # Someone holding the pre-login cookie is not logged in
+    attacker = app.test_client()
+    attacker.set_cookie(name, app.session_interface.signer(app).sign(before).decode())
+    assert attacker.get('/api/v1/orders').status_code == 401
+
+    client.get('/logout')
+    assert store.load(after) is None, 'logout kept the session id'
+    print('Logging in and out moves the session to a new id and deletes the old one')
+
+def main(count):
+    results = {}
+    for backend in BACKENDS:
+        app, user_id, results[backend] = time_backend(backend, count)
+        if backend != 'cookie':
+            print(f'{backend}: session not loaded for static files or public API calls')
+        # The memory store can be read directly, without an app context
+        if backend == 'memory':
+            check_fixation(app, user_id)
+
+    print(f'Median per request over {count} requests (ms):')
+    print(f'{"":<28}' + ''.join(f'{backend:>9}' for backend in BACKENDS))
+    for label in results['cookie']:
+        print(f'  {label:<26}' + ''.join(f'{results[backend][label]:>9.2f}' for backend in BACKENDS))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,45 @@
+"""
+Shared setup for the benchmark scripts. Each script runs against its own temporary
+database, so the app's instance/sitedata.sqlite is never touched:
+
+    python -m benchmarks.bench_jobs
+"""
+from datetime import datetime, timedelta
+import os
+import tempfile
+
+def make_app(**environ):
+    """Create the app on a fresh temporary database. environ is set first, e.g. INVALIDATION_BACKEND='sqlite'."""
+    os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.sqlite'))
+    os.environ.update(environ)
+    from website import create_app, db
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        db.create_all()
+    return app
+
+def add_user(email='bench@example.com'):
+    from website import db
+    from website.models import User
+    user = User(first_name='Bench', surname='User', email=email, password_hash='x')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+def add_event(creator, title='Bench Fest', total_tickets=100, **values):
+    from website import db
+    from website.models import Event, EventCategory
+    now = datetime.now()
+    event = Event(title=title, start_time=now, end_time=now + timedelta(days=2), venue='1 Bench St',
+                  total_tickets=total_tickets, ticket_price=10, category_type=EventCategory.FOOD,
+                  creator_id=creator.id, **values)
+    db.session.add(event)
+    db.session.commit()
+    return event
+
+def login(client, user_id):
+    """Log a test client in as user_id without going through the login form."""
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
@@ -0,0 +1,16 @@
+import sys
+from website import create_app
+from website.counters import check_counters
+
+# Check the event comment/ticket/revenue counters, pass --repair to fix them
+if __name__ == '__main__':
+    repair = '--repair' in sys.argv
+    app = create_app()
+    with app.app_context():
+        mismatches = check_counters(repair=repair)
+    for event_id, counter, stored, actual in mismatches:
+        print(f'Event {event_id}: {counter} is {stored}, should be {actual}')
+    if not mismatches:
+        print('All event counters are consistent')
+    elif repair:
+        print(f'Repaired {len(mismatches)} counters')
@@ -1,4 +1,5 @@
 # import flask - from 'package' import 'Class'
+import os
 from flask import Flask, render_template
 from flask_bootstrap import Bootstrap5
 from flask_sqlalchemy import SQLAlchemy
@@ -13,12 +14,38 @@ def create_app():
    app = Flask(__name__)  # this is the name of the module/package that is calling this app
    # Should be set to false in a production environment
    app.debug = False
-   app.secret_key = 'somesecretkey'
+   # set SECRET_KEY in the environment in production
+   app.secret_key = os.environ.get('SECRET_KEY', 'somesecretkey')
    # set the app configuration data 
-   app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///sitedata.sqlite'
+   app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///sitedata.sqlite')
    # initialise db with flask app
    db.init_app(app)
 
+   # waiting room: how many buyers may be purchasing tickets for one event at a time
+   app.config['ADMISSION_MAX_ACTIVE'] = 50
+   # set to e.g. 'redis://localhost:6379/0' to share the waiting room between workers
+   app.config['ADMISSION_REDIS_URL'] = os.environ.get('ADMISSION_REDIS_URL')
+   from .admission import init_admission
+   init_admission(app)
+
+   # session data is kept server-side, the cookie only holds the session id.
+   # 'memory' suits a single process, use 'sqlite' or 'redis' when running several workers
+   app.config['SESSION_BACKEND'] = os.environ.get('SESSION_BACKEND', 'memory')
+   app.config['SESSION_REDIS_URL'] = os.environ.get('SESSION_REDIS_URL')
+   from .sessions import init_sessions
+   init_sessions(app)
+
+   # changes to events, users etc. are announced to every worker's caches when committed.
+   # 'memory' suits a single process, use 'sqlite' or 'redis' when running several workers
+   app.config['INVALIDATION_BACKEND'] = os.environ.get('INVALIDATION_BACKEND', 'memory')
+   app.config['INVALIDATION_REDIS_URL'] = os.environ.get('INVALIDATION_REDIS_URL')
+   from .invalidation import init_invalidation
+   init_invalidation(app)
+
+   # new comments are queued and written in batches
+   from .comments import init_comments
+   init_comments(app)
+
    Bootstrap5(app)
    
    # initialise the login manager
@@ -36,6 +63,8 @@ def create_app():
    # create a user loader function takes userid and returns User
    # Importing inside the create_app function avoids circular references
    from .models import User
+   # registers the event location R-tree so db.create_all() creates it
+   from . import geo
    @login_manager.user_loader
    def load_user(user_id):
       return db.session.scalar(db.select(User).where(User.id==user_id))
@@ -43,7 +72,7 @@ def create_app():
    @app.errorhandler(404) 
    # inbuilt function which takes error as parameter 
    def not_found(e): 
-      return render_template("404.html", error=e)
+      return render_template("404.html", error=e), 404
    
    @app.errorhandler(500)
    def server_error(e):
@@ -62,5 +91,8 @@ def create_app():
 
    from . users import user_bp
    app.register_blueprint(users.user_bp)
+
+   from . import api
+   app.register_blueprint(api.api_bp)
    
    return app
\ No newline at end of file
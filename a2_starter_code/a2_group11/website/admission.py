@@ -0,0 +1,150 @@
+from collections import OrderedDict
+from functools import wraps
+import threading
+import time
+from flask import current_app, redirect, url_for, abort
+from flask_login import current_user
+from . models import Event
+from . import db
+
+# Defaults, overridden by app.config in create_app()
+MAX_ACTIVE_BUYERS = 50
+# How long an admitted buyer keeps their place before it is given to the next in line
+ACTIVE_SECONDS = 15 * 60
+# Queued buyers who stop polling for this long are skipped when their turn comes
+QUEUE_TIMEOUT_SECONDS = 60
+
+class MemoryAdmissionStore:
+    """Admission state kept in this process. Only suitable for a single worker."""
+
+    def __init__(self, max_active, active_seconds, queue_timeout):
+        self.max_active = max_active
+        self.active_seconds = active_seconds
+        self.queue_timeout = queue_timeout
+        self.lock = threading.Lock()
+        # event_id -> {user_id: expires_at}
+        self.active = {}
+        # event_id -> OrderedDict(user_id -> [arrival number, last_seen]), in arrival order
+        self.queues = {}
+        # event_id -> last arrival number given out for that event
+        self.arrivals = {}
+
+    def enter(self, event_id, user_id):
+        """Admit the user if there is room, otherwise queue them. Returns 0 if admitted, else the queue position."""
+        now = time.time()
+        with self.lock:
+            active = self.active.setdefault(event_id, {})
+            queue = self.queues.setdefault(event_id, OrderedDict())
+            for uid in [uid for uid, expires_at in active.items() if expires_at <= now]:
+                del active[uid]
+            if user_id in active:
+                return 0
+
+            if user_id in queue:
+                queue[user_id][1] = now
+            else:
+                arrival = self.arrivals.get(event_id, 0) + 1
+                self.arrivals[event_id] = arrival
+                queue[user_id] = [arrival, now]
+            while len(active) < self.max_active and queue:
+                uid, (_, last_seen) = queue.popitem(last=False)
+                if last_seen + self.queue_timeout >= now:
+                    active[uid] = now + self.active_seconds
+            if user_id in active:
+                return 0
+            # Arrival numbers are per event and only have gaps where queued users left,
+            # so this is the position in line (at most overstated by those who left
+            # from further ahead) without walking the queue
+            head = next(iter(queue.values()))[0]
+            return queue[user_id][0] - head + 1
+
+    def leave(self, event_id, user_id):
+        """Free the user's place, e.g. once their purchase is complete."""
+        with self.lock:
+            self.active.get(event_id, {}).pop(user_id, None)
+            self.queues.get(event_id, OrderedDict()).pop(user_id, None)
+
+class RedisAdmissionStore:
+    """Admission state kept in Redis (or a Redis-compatible server), shared by every worker."""
+
+    # Same algorithm as MemoryAdmissionStore.enter, run atomically on the server.
+    # KEYS: active zset (score = expiry), queue zset (score = arrival), last-seen hash, arrival counter
+    ENTER_SCRIPT = """
+    local user, now = ARGV[1], tonumber(ARGV[2])
+    local max_active, active_seconds, queue_timeout = tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5])
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+    if redis.call('ZSCORE', KEYS[1], user) then return 0 end
+    if not redis.call('ZSCORE', KEYS[2], user) then
+        redis.call('ZADD', KEYS[2], redis.call('INCR', KEYS[4]), user)
+    end
+    redis.call('HSET', KEYS[3], user, now)
+    while redis.call('ZCARD', KEYS[1]) < max_active do
+        local head = redis.call('ZRANGE', KEYS[2], 0, 0)
+        if #head == 0 then break end
+        redis.call('ZREM', KEYS[2], head[1])
+        local last_seen = tonumber(redis.call('HGET', KEYS[3], head[1]))
+        redis.call('HDEL', KEYS[3], head[1])
+        if last_seen and last_seen + queue_timeout >= now then
+            redis.call('ZADD', KEYS[1], now + active_seconds, head[1])
+        end
+    end
+    if redis.call('ZSCORE', KEYS[1], user) then return 0 end
+    return redis.call('ZRANK', KEYS[2], user) + 1
+    """
+
+    def __init__(self, url, max_active, active_seconds, queue_timeout):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('ADMISSION_REDIS_URL is set but the redis package is not installed (pip install redis)')
+        self.client = redis.Redis.from_url(url)
+        self.enter_script = self.client.register_script(self.ENTER_SCRIPT)
+        self.max_active = max_active
+        self.active_seconds = active_seconds
+        self.queue_timeout = queue_timeout
+
+    def keys(self, event_id):
+        prefix = f'admission:{event_id}'
+        return [f'{prefix}:active', f'{prefix}:queue', f'{prefix}:seen', f'{prefix}:seq']
+
+    def enter(self, event_id, user_id):
+        args = [user_id, time.time(), self.max_active, self.active_seconds, self.queue_timeout]
+        return int(self.enter_script(keys=self.keys(event_id), args=args))
+
+    def leave(self, event_id, user_id):
+        active, queue, seen, _ = self.keys(event_id)
+        pipe = self.client.pipeline()
+        pipe.zrem(active, user_id)
+        pipe.zrem(queue, user_id)
+        pipe.hdel(seen, user_id)
+        pipe.execute()
+
+def init_admission(app):
+    """Create the admission store from app.config and attach it to the app."""
+    max_active = app.config.get('ADMISSION_MAX_ACTIVE', MAX_ACTIVE_BUYERS)
+    active_seconds = app.config.get('ADMISSION_ACTIVE_SECONDS', ACTIVE_SECONDS)
+    queue_timeout = app.config.get('ADMISSION_QUEUE_TIMEOUT', QUEUE_TIMEOUT_SECONDS)
+    redis_url = app.config.get('ADMISSION_REDIS_URL')
+    if redis_url:
+        store = RedisAdmissionStore(redis_url, max_active, active_seconds, queue_timeout)
+    else:
+        store = MemoryAdmissionStore(max_active, active_seconds, queue_timeout)
+    app.extensions['admission'] = store
+
+def admission_store():
+    return current_app.extensions['admission']
+
+def require_event(event_id):
+    """404 for unknown events, so they are never given a place in a queue."""
+    if db.session.scalar(db.select(Event.id).where(Event.id == event_id)) is None:
+        abort(404)
+
+def admission_required(view):
+    """Only let admitted buyers through to the view; everyone else is sent to the waiting room."""
+    @wraps(view)
+    def wrapped(event_id, *args, **kwargs):
+        require_event(event_id)
+        if admission_store().enter(event_id, current_user.id):
+            return redirect(url_for('events.waiting_room', event_id=event_id))
+        return view(event_id, *args, **kwargs)
+    return wrapped
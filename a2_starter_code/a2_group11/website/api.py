@@ -0,0 +1,195 @@
+from datetime import datetime
+from decimal import Decimal
+import enum
+import gzip
+from flask import Blueprint, request, jsonify, url_for, abort
+from flask_login import current_user
+from . models import Event, Comment, Order, User
+from . browse import parse_filters, range_conditions, facet_conditions
+from . reservations import active_holds
+from . import db
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+api_bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+# Responses smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 500
+
+def tickets_remaining():
+    """Total tickets minus the tickets in active holds, as of this request."""
+    return Event.total_tickets - active_holds(Event.id, datetime.now()).scalar_subquery()
+
+# Fields that can be requested with ?fields=, mapped to the columns they are read from.
+# List endpoints select these columns directly rather than loading ORM objects.
+# A function is called per request, for fields that depend on the current time.
+EVENT_FIELDS = {
+    'id': Event.id,
+    'title': Event.title,
+    'image': Event.image,
+    'start_time': Event.start_time,
+    'end_time': Event.end_time,
+    'venue': Event.venue,
+    'vendor_names': Event.vendor_names,
+    'description': Event.description,
+    'tickets_remaining': tickets_remaining,
+    'ticket_price': Event.ticket_price,
+    'free_sampling': Event.free_sampling,
+    'provide_takeaway': Event.provide_takeaway,
+    'category': Event.category_type,
+    'status': Event.status,
+    'comments_count': Event.comments_count,
+    'tickets_sold': Event.tickets_sold,
+    'version': Event.version,
+}
+
+COMMENT_FIELDS = {
+    'id': Comment.id,
+    'contents': Comment.contents,
+    'comment_date': Comment.comment_date,
+    'first_name': User.first_name,
+    'surname': User.surname,
+}
+
+ORDER_FIELDS = {
+    'id': Order.id,
+    'event_id': Order.event_id,
+    'event_title': Event.title,
+    'tickets_purchased': Order.tickets_purchased,
+    'purchased_amount': Order.purchased_amount,
+    'booking_time': Order.booking_time,
+}
+
+def _value(value):
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+def selected_fields(available):
+    """Columns for the fields named in ?fields=, or every field if it is not given."""
+    fields = request.args.get('fields')
+    if not fields:
+        return available
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        abort(400, description=f'Unknown fields: {", ".join(unknown)}')
+    # Always include the id, it is needed for the next page cursor
+    return {name: available[name] for name in ['id'] + [name for name in names if name != 'id']}
+
+def fetch_rows(fields, query):
+    """Run a select of the given fields and return the rows as plain dicts."""
+    columns = [(column() if callable(column) else column).label(name) for name, column in fields.items()]
+    query = query.add_columns(*columns)
+    return [
+        {name: _value(value) for name, value in row.items()}
+        for row in db.session.execute(query).mappings()
+    ]
+
+def page(fields, query, id_column, descending=False):
+    """
+    Keyset pagination on id_column: ?after=<id> continues from the last row of the
+    previous page, so later pages cost the same as the first.
+    """
+    limit = min(max(request.args.get('limit', DEFAULT_LIMIT, type=int), 1), MAX_LIMIT)
+    after = request.args.get('after', type=int)
+    if after is not None:
+        query = query.where(id_column < after if descending else id_column > after)
+    query = query.order_by(id_column.desc() if descending else id_column).limit(limit + 1)
+    rows = fetch_rows(fields, query)
+    next_url = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        args = dict(request.args.to_dict(flat=False), after=rows[-1]['id'])
+        next_url = url_for(request.endpoint, **request.view_args, **args)
+    return jsonify(data=rows, next=next_url)
+
+def event_etag(event_id):
+    """
+    ETag for an event's details and comments, or 404 if the event does not exist.
+    Holds change tickets_remaining without bumping the version, so the held count is
+    part of the tag.
+    """
+    row = db.session.execute(
+        db.select(Event.version, active_holds(Event.id, datetime.now()).scalar_subquery())
+        .where(Event.id == event_id)
+    ).first()
+    if row is None:
+        abort(404)
+    version, held = row
+    return f'event-{event_id}-v{version}-h{held}'
+
+def not_modified(etag):
+    # The ETags are weak: the identity, gzip and br bodies share one tag, which is only
+    # allowed for weak validators
+    return request.if_none_match.contains_weak(etag)
+
+@api_bp.errorhandler(400)
+@api_bp.errorhandler(401)
+@api_bp.errorhandler(404)
+def api_error(e):
+    return jsonify(error=e.description), e.code
+
+@api_bp.after_request
+def compress(response):
+    """Brotli (if installed) or gzip compress JSON responses the client accepts."""
+    if response.direct_passthrough or response.status_code != 200:
+        return response
+    data = response.get_data()
+    if len(data) < MIN_COMPRESS_SIZE or 'Content-Encoding' in response.headers:
+        return response
+    accepted = request.accept_encodings
+    if brotli is not None and 'br' in accepted:
+        response.set_data(brotli.compress(data))
+        response.headers['Content-Encoding'] = 'br'
+    elif 'gzip' in accepted:
+        response.set_data(gzip.compress(data, compresslevel=5))
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        return response
+    response.vary.add('Accept-Encoding')
+    return response
+
+# List events, accepts the same filters as the browse page
+@api_bp.route('/events')
+def events():
+    filters = parse_filters(request.args)
+    conditions = range_conditions(filters) + list(facet_conditions(filters).values())
+    return page(selected_fields(EVENT_FIELDS), db.select().select_from(Event).where(*conditions), Event.id)
+
+@api_bp.route('/events/<int:event_id>')
+def event_detail(event_id):
+    etag = event_etag(event_id)
+    if not_modified(etag):
+        return '', 304, {'ETag': f'W/"{etag}"'}
+    rows = fetch_rows(selected_fields(EVENT_FIELDS), db.select().select_from(Event).where(Event.id == event_id))
+    response = jsonify(data=rows[0])
+    response.set_etag(etag, weak=True)
+    return response
+
+@api_bp.route('/events/<int:event_id>/comments')
+def event_comments(event_id):
+    etag = event_etag(event_id)
+    if not_modified(etag):
+        return '', 304, {'ETag': f'W/"{etag}"'}
+    query = db.select().select_from(Comment).join(User, Comment.user_id == User.id).where(Comment.event_id == event_id)
+    response = page(selected_fields(COMMENT_FIELDS), query, Comment.id)
+    response.set_etag(etag, weak=True)
+    return response
+
+# The logged in user's orders, newest first
+@api_bp.route('/orders')
+def orders():
+    if not current_user.is_authenticated:
+        abort(401, description='Login required')
+    query = db.select().select_from(Order).join(Event, Order.event_id == Event.id).where(Order.user_id == current_user.id)
+    return page(selected_fields(ORDER_FIELDS), query, Order.id, descending=True)
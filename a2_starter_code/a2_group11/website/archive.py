@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+from . models import (
+    Event, EventStatus, Order, Comment, Reservation, Job, JobStatus, DeadJob,
+    ArchivedEvent, ArchivedOrder, ArchivedComment
+)
+from . import db
+
+# Finished events are archived this many days after they end
+RETENTION_DAYS = 90
+# Events moved per transaction, kept small so the database is never locked for long
+BATCH_SIZE = 100
+
+# Statuses of events that are over. Sold out events keep their status after they end,
+# so they count as finished once end_time has passed.
+FINISHED_STATUSES = (EventStatus.INACTIVE, EventStatus.CANCELLED, EventStatus.SOLDOUT)
+
+def _copy(source, target, where):
+    """INSERT INTO target SELECT the matching columns FROM source WHERE where."""
+    names = [c.name for c in target.__table__.columns if c.name in source.__table__.columns]
+    columns = [source.__table__.c[name] for name in names]
+    db.session.execute(db.insert(target).from_select(names, db.select(*columns).where(where)))
+
+def archivable_events(cutoff, limit):
+    """Ids of finished events that ended before cutoff and have no queued jobs left to run."""
+    unfinished_jobs = (
+        db.select(Job.id)
+        .join(Order, Order.id == Job.order_id)
+        .where(Order.event_id == Event.id, Job.status.in_([JobStatus.PENDING, JobStatus.RUNNING]))
+        .exists()
+    )
+    return db.session.scalars(
+        db.select(Event.id)
+        .where(Event.status.in_(FINISHED_STATUSES), Event.end_time < cutoff, ~unfinished_jobs)
+        .limit(limit)
+    ).all()
+
+def archive_batch(event_ids):
+    """Move these events and their orders and comments to the archive tables in one transaction."""
+    order_ids = db.select(Order.id).where(Order.event_id.in_(event_ids))
+    _copy(Event, ArchivedEvent, Event.id.in_(event_ids))
+    _copy(Order, ArchivedOrder, Order.event_id.in_(event_ids))
+    _copy(Comment, ArchivedComment, Comment.event_id.in_(event_ids))
+    # Jobs and old holds are not archived. Only finished (DONE) and dead-lettered jobs are
+    # left by now, and dead letters are dropped with their job so none point at a deleted order
+    job_ids = db.select(Job.id).where(Job.order_id.in_(order_ids))
+    db.session.execute(db.delete(DeadJob).where(DeadJob.job_id.in_(job_ids)))
+    db.session.execute(db.delete(Job).where(Job.order_id.in_(order_ids)))
+    db.session.execute(db.delete(Reservation).where(Reservation.event_id.in_(event_ids)))
+    db.session.execute(db.delete(Comment).where(Comment.event_id.in_(event_ids)))
+    db.session.execute(db.delete(Order).where(Order.event_id.in_(event_ids)))
+    db.session.execute(db.delete(Event).where(Event.id.in_(event_ids)))
+    db.session.commit()
+
+def archive_events(retention_days=RETENTION_DAYS, batch_size=BATCH_SIZE):
+    """Archive every finished event that ended more than retention_days ago. Returns how many were moved."""
+    cutoff = datetime.now() - timedelta(days=retention_days)
+    archived = 0
+    while True:
+        event_ids = archivable_events(cutoff, batch_size)
+        if not event_ids:
+            return archived
+        archive_batch(event_ids)
+        archived += len(event_ids)
@@ -0,0 +1,205 @@
+from datetime import datetime, timedelta
+import time
+from sqlalchemy import DDL, and_, case, column, event as sa_event, func, table, true
+from . models import Event, EventCategory, EventStatus
+from . import db
+
+# How long facet counts are reused before being recounted. They are not cleared when an
+# event changes: every ticket sale would expire them, and a recount is cheap.
+FACET_CACHE_SECONDS = 30
+FACET_CACHE_SIZE = 1000
+# Events shown per browse page
+PAGE_SIZE = 48
+
+# Facet name -> (column, values that can be selected)
+FACETS = {
+    'category': (Event.category_type, list(EventCategory)),
+    'status': (Event.status, list(EventStatus)),
+    'free_sampling': (Event.free_sampling, [True, False]),
+    'provide_takeaway': (Event.provide_takeaway, [True, False]),
+}
+
+# (filters key) -> (expires_at, counts)
+facet_cache = {}
+
+# Number of events for each combination of facet values and start day, so facet counts
+# add up a few thousand rows instead of scanning every event. Kept in sync with events by
+# triggers, so the ORM never writes to it. NULL values are stored as -1 / '' so every
+# combination has exactly one row.
+event_facet_counts = table(
+    'event_facet_counts',
+    column('category_type', Event.category_type.type),
+    column('status', Event.status.type),
+    column('free_sampling', db.Boolean()),
+    column('provide_takeaway', db.Boolean()),
+    column('day'),
+    column('count'),
+)
+
+_FACET_KEY = "{row}.category_type, IFNULL({row}.status, ''), IFNULL({row}.free_sampling, -1), IFNULL({row}.provide_takeaway, -1), date({row}.start_time)"
+_FACET_MATCH = """category_type = {row}.category_type AND status = IFNULL({row}.status, '')
+    AND free_sampling = IFNULL({row}.free_sampling, -1) AND provide_takeaway = IFNULL({row}.provide_takeaway, -1)
+    AND day = date({row}.start_time)"""
+_ADD_FACET_ROW = f"""
+    INSERT INTO event_facet_counts VALUES ({_FACET_KEY.format(row='NEW')}, 1)
+    ON CONFLICT DO UPDATE SET count = count + 1;
+"""
+_REMOVE_FACET_ROW = f"""
+    UPDATE event_facet_counts SET count = count - 1 WHERE {_FACET_MATCH.format(row='OLD')};
+"""
+
+FACET_COUNTS_DDL = [
+    """CREATE TABLE IF NOT EXISTS event_facet_counts (
+        category_type, status, free_sampling, provide_takeaway, day, count INTEGER NOT NULL,
+        PRIMARY KEY (day, category_type, status, free_sampling, provide_takeaway)
+    ) WITHOUT ROWID""",
+    f"""CREATE TRIGGER IF NOT EXISTS events_facets_insert AFTER INSERT ON events BEGIN
+        {_ADD_FACET_ROW}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS events_facets_update
+    AFTER UPDATE OF category_type, status, free_sampling, provide_takeaway, start_time ON events
+    WHEN ({_FACET_KEY.format(row='OLD')}) IS NOT ({_FACET_KEY.format(row='NEW')}) BEGIN
+        {_REMOVE_FACET_ROW}
+        {_ADD_FACET_ROW}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS events_facets_delete AFTER DELETE ON events BEGIN
+        {_REMOVE_FACET_ROW}
+    END""",
+]
+
+# Created and dropped with the events table by db.create_all() / db.drop_all()
+for statement in FACET_COUNTS_DDL:
+    sa_event.listen(Event.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+sa_event.listen(Event.__table__, 'after_drop', DDL("DROP TABLE IF EXISTS event_facet_counts").execute_if(dialect='sqlite'))
+
+# Facet name -> the event_facet_counts column holding it
+FACET_COUNT_COLUMNS = {
+    'category': event_facet_counts.c.category_type,
+    'status': event_facet_counts.c.status,
+    'free_sampling': event_facet_counts.c.free_sampling,
+    'provide_takeaway': event_facet_counts.c.provide_takeaway,
+}
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return None
+
+def _parse_price(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _parse_enum(enum_type, values):
+    selected = []
+    for value in values:
+        try:
+            selected.append(enum_type(value))
+        except ValueError:
+            pass
+    return selected
+
+def parse_filters(args):
+    """Read browse filters from the query string. Unknown or invalid values are ignored."""
+    return {
+        'category': _parse_enum(EventCategory, args.getlist('category')),
+        'status': _parse_enum(EventStatus, args.getlist('status')),
+        'free_sampling': [value == '1' for value in args.getlist('free_sampling') if value in ('0', '1')],
+        'provide_takeaway': [value == '1' for value in args.getlist('provide_takeaway') if value in ('0', '1')],
+        'start': _parse_date(args.get('start')),
+        'end': _parse_date(args.get('end')),
+        'min_price': _parse_price(args.get('min_price')),
+        'max_price': _parse_price(args.get('max_price')),
+    }
+
+def range_conditions(filters):
+    """Date and price filters, which apply to every facet."""
+    conditions = []
+    if filters['start']:
+        conditions.append(Event.start_time >= filters['start'])
+    if filters['end']:
+        # The end date is inclusive
+        conditions.append(Event.start_time < filters['end'] + timedelta(days=1))
+    if filters['min_price'] is not None:
+        conditions.append(Event.ticket_price >= filters['min_price'])
+    if filters['max_price'] is not None:
+        conditions.append(Event.ticket_price <= filters['max_price'])
+    return conditions
+
+def facet_conditions(filters):
+    """Facet name -> condition for the values selected in that facet."""
+    conditions = {}
+    for name, (column, _) in FACETS.items():
+        if filters[name]:
+            conditions[name] = column.in_(filters[name])
+    return conditions
+
+def browse_events(filters, order_by, page=1):
+    """Return one page of events matching every filter."""
+    conditions = range_conditions(filters) + list(facet_conditions(filters).values())
+    query = (
+        db.select(Event)
+        .where(*conditions)
+        .order_by(*order_by)
+        .limit(PAGE_SIZE)
+        .offset((page - 1) * PAGE_SIZE)
+    )
+    return db.session.scalars(query).all()
+
+def _cache_key(filters):
+    return tuple(
+        (name, tuple(str(value) for value in values) if isinstance(values, list) else str(values))
+        for name, values in filters.items()
+    )
+
+def _facet_count_source(filters):
+    """
+    Where facet counts come from: (facet name -> column, how much each row counts, conditions).
+    event_facet_counts when only facets and dates are filtered, otherwise the events
+    themselves, as prices are not kept in event_facet_counts.
+    """
+    if filters['min_price'] is None and filters['max_price'] is None:
+        conditions = []
+        if filters['start']:
+            conditions.append(event_facet_counts.c.day >= filters['start'].strftime('%Y-%m-%d'))
+        if filters['end']:
+            conditions.append(event_facet_counts.c.day <= filters['end'].strftime('%Y-%m-%d'))
+        return FACET_COUNT_COLUMNS, event_facet_counts.c.count, conditions
+    return {name: column for name, (column, _) in FACETS.items()}, 1, range_conditions(filters)
+
+def facet_counts(filters):
+    """
+    Count matching events for every value of every facet, in a single query.
+    Each facet's counts apply all the other filters but not its own, so selecting
+    "Food" still shows how many events are in the other categories.
+    Returns {facet name: {value: count}}, cached for FACET_CACHE_SECONDS.
+    Price filters need a scan of every event in the date range, everything else adds up
+    event_facet_counts.
+    """
+    key = _cache_key(filters)
+    now = time.monotonic()
+    cached = facet_cache.get(key)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    facet_columns, weight, conditions = _facet_count_source(filters)
+    selected = {name: facet_columns[name].in_(filters[name]) for name in FACETS if filters[name]}
+    columns = []
+    labels = []
+    for name, (_, values) in FACETS.items():
+        others = and_(true(), *[condition for other, condition in selected.items() if other != name])
+        for value in values:
+            columns.append(func.sum(case((and_(others, facet_columns[name] == value), weight), else_=0)))
+            labels.append((name, value))
+
+    row = db.session.execute(db.select(*columns).where(*conditions)).one()
+    counts = {name: {} for name in FACETS}
+    for (name, value), count in zip(labels, row):
+        counts[name][value] = count or 0
+
+    if len(facet_cache) >= FACET_CACHE_SIZE:
+        facet_cache.clear()
+    facet_cache[key] = (now + FACET_CACHE_SECONDS, counts)
+    return counts
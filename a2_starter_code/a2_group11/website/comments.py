@@ -0,0 +1,172 @@
+from collections import Counter, OrderedDict
+from datetime import datetime
+import atexit
+import logging
+import threading
+from flask import current_app, render_template
+from sqlalchemy.exc import OperationalError
+from . models import Comment, Event
+from . import db
+
+# Comments are written when this many are waiting, or after FLUSH_SECONDS, whichever is first
+BATCH_SIZE = 100
+FLUSH_SECONDS = 0.25
+# A comment that fails to save this many times is dropped, so it cannot hold up the rest
+MAX_ATTEMPTS = 3
+# Rendered comment lists kept before the least recently used are dropped
+FRAGMENT_CACHE_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+class CommentBatcher:
+    """
+    Queues new comments in this process and writes them in grouped transactions from a
+    background thread, instead of one INSERT and commit per comment.
+    """
+
+    def __init__(self, app, batch_size=BATCH_SIZE, flush_seconds=FLUSH_SECONDS, max_fragments=FRAGMENT_CACHE_SIZE):
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.pending = []
+        self.thread = None
+        self.max_fragments = max_fragments
+        # event_id -> (comments_count, rendered comment list), see comment_fragment()
+        self.fragments = OrderedDict()
+
+    def submit(self, event_id, user_id, contents):
+        """Queue a comment. It is saved within FLUSH_SECONDS."""
+        with self.lock:
+            self.pending.append({
+                'event_id': event_id,
+                'user_id': user_id,
+                'contents': contents,
+                'comment_date': datetime.now(),
+                'attempts': 0,
+            })
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+                atexit.register(self.flush)
+            if len(self.pending) >= self.batch_size:
+                self.wake.set()
+
+    def pending_for(self, event_id, user_id):
+        """The user's comments on this event that have not been saved yet."""
+        with self.lock:
+            return [c for c in self.pending if c['event_id'] == event_id and c['user_id'] == user_id]
+
+    def run(self):
+        while True:
+            self.wake.wait(self.flush_seconds)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                # Keep the thread alive, the comments are still queued for the next flush
+                logger.exception('Comment flush failed')
+
+    def flush(self):
+        """
+        Write every queued comment in one transaction. If that fails, each comment is tried
+        on its own so one bad comment cannot hold up the others, and a comment that fails
+        MAX_ATTEMPTS times is dropped. If the database itself is unavailable the comments
+        are kept for the next flush without counting an attempt. Returns how many were written.
+        """
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if not batch:
+            return 0
+        written = 0
+        tried = 0
+        retry = []
+        with self.app.app_context():
+            try:
+                if self.write(batch):
+                    return len(batch)
+                for c in batch:
+                    saved = self.write([c])
+                    tried += 1
+                    if saved:
+                        written += 1
+                    elif c['attempts'] + 1 < MAX_ATTEMPTS:
+                        retry.append(dict(c, attempts=c['attempts'] + 1))
+                    else:
+                        logger.error('Dropping comment on event %s by user %s after %s failed attempts',
+                                     c['event_id'], c['user_id'], MAX_ATTEMPTS)
+            except OperationalError:
+                logger.exception('Database unavailable, comments will be saved with the next flush')
+            finally:
+                db.session.remove()
+        # Put failures, and anything not tried yet, back for the next flush
+        with self.lock:
+            self.pending = retry + batch[tried:] + self.pending
+        return written
+
+    def write(self, batch):
+        """
+        Save these comments and update their events' counters in one transaction.
+        Returns False if a comment could not be saved, OperationalError is raised.
+        """
+        try:
+            comments = [Comment(event_id=c['event_id'], user_id=c['user_id'], contents=c['contents'],
+                                comment_date=c['comment_date']) for c in batch]
+            db.session.add_all(comments)
+            for event_id, count in Counter(c['event_id'] for c in batch).items():
+                db.session.execute(
+                    db.update(Event)
+                    .where(Event.id == event_id)
+                    .values(comments_count=Event.comments_count + count, version=Event.version + 1)
+                )
+            db.session.commit()
+        except OperationalError:
+            db.session.rollback()
+            raise
+        except Exception:
+            db.session.rollback()
+            logger.exception('Saving %s comments failed', len(batch))
+            return False
+        self.append_to_fragments(comments)
+        return True
+
+    def append_to_fragments(self, comments):
+        """Add new comments to cached comment lists rather than rendering the whole list again."""
+        with self.lock:
+            for comment in comments:
+                cached = self.fragments.get(comment.event_id)
+                if cached is not None:
+                    count, html = cached
+                    self.fragments[comment.event_id] = (count + 1, html + render_template('events/_comment.html', comment=comment))
+
+    def comment_fragment(self, event):
+        """The event's rendered comment list, rebuilt only if comments were saved by another process."""
+        with self.lock:
+            cached = self.fragments.get(event.id)
+            if cached is not None:
+                self.fragments.move_to_end(event.id)
+        if cached is not None and cached[0] == event.comments_count:
+            return cached[1]
+        comments = db.session.scalars(db.select(Comment).where(Comment.event_id == event.id).order_by(Comment.id)).all()
+        html = ''.join(render_template('events/_comment.html', comment=comment) for comment in comments)
+        with self.lock:
+            self.fragments[event.id] = (len(comments), html)
+            self.fragments.move_to_end(event.id)
+            while len(self.fragments) > self.max_fragments:
+                self.fragments.popitem(last=False)
+        return html
+
+    def invalidate_all(self, user_id, version):
+        """Called by the invalidation bus when a user changes, their name may be in any comment list."""
+        with self.lock:
+            self.fragments.clear()
+
+def init_comments(app):
+    batcher = CommentBatcher(app)
+    app.extensions['comment_batcher'] = batcher
+    bus = app.extensions['invalidation_bus']
+    bus.subscribe('users', batcher.invalidate_all)
+
+def comment_batcher():
+    return current_app.extensions['comment_batcher']
@@ -0,0 +1,53 @@
+from sqlalchemy import func
+from . models import Event, Comment, Order
+from . import db
+
+def check_counters(repair=False):
+    """
+    Compare Event.comments_count, tickets_sold and revenue against the Comment and Order
+    tables. Returns a list of (event_id, counter, stored, actual) for every mismatch, and
+    fixes them if repair is True.
+    """
+    comments = (
+        db.select(Comment.event_id, func.count(Comment.id).label('comments_count'))
+        .group_by(Comment.event_id)
+        .subquery()
+    )
+    orders = (
+        db.select(
+            Order.event_id,
+            func.sum(Order.tickets_purchased).label('tickets_sold'),
+            func.sum(Order.purchased_amount).label('revenue')
+        )
+        .group_by(Order.event_id)
+        .subquery()
+    )
+    rows = db.session.execute(
+        db.select(
+            Event.id, Event.comments_count, Event.tickets_sold, Event.revenue,
+            func.coalesce(comments.c.comments_count, 0),
+            func.coalesce(orders.c.tickets_sold, 0),
+            func.coalesce(orders.c.revenue, 0)
+        )
+        .outerjoin(comments, comments.c.event_id == Event.id)
+        .outerjoin(orders, orders.c.event_id == Event.id)
+    ).all()
+
+    mismatches = []
+    for event_id, comments_count, tickets_sold, revenue, actual_comments, actual_sold, actual_revenue in rows:
+        for counter, stored, actual in (
+            ('comments_count', comments_count, actual_comments),
+            ('tickets_sold', tickets_sold, actual_sold),
+            ('revenue', revenue, actual_revenue),
+        ):
+            if stored != actual:
+                mismatches.append((event_id, counter, stored, actual))
+
+    if repair and mismatches:
+        updates = {}
+        for event_id, counter, stored, actual in mismatches:
+            updates.setdefault(event_id, {'id': event_id})[counter] = actual
+        db.session.execute(db.update(Event), list(updates.values()))
+        db.session.execute(db.update(Event).where(Event.id.in_(list(updates))).values(version=Event.version + 1))
+        db.session.commit()
+    return mismatches
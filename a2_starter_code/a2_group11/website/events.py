@@ -1,8 +1,13 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, abort
+from flask import Blueprint, render_template, request, redirect, url_for, flash, abort, jsonify
 from datetime import datetime
-from . models import Event, Order, EventStatus, Comment
-from . forms import EventForm, CommentForm, PurchaseTicketForm, check_upload_file
+from sqlalchemy import case, literal
+from . models import Event, EventStatus, Reservation, ReservationStatus
+from . forms import EventForm, CommentForm, PurchaseTicketForm, ConfirmReservationForm, check_upload_file
 from . import db
+from . reservations import available_tickets, hold_tickets, confirm_reservation, release_reservation, reservation_for_key
+from . admission import admission_required, admission_store, require_event
+from . geo import get_or_create_venue
+from . comments import comment_batcher
 from flask_login import login_required, current_user
 
 event_bp = Blueprint('events', __name__, url_prefix='/events')
@@ -13,7 +18,10 @@ def show(event_id):
     # Generate comment form
     form = CommentForm()
     live_status()
-    return render_template('events/show.html', event=event, form=form)
+    comments_html = comment_batcher().comment_fragment(event)
+    pending_comments = comment_batcher().pending_for(event.id, current_user.id) if current_user.is_authenticated else []
+    return render_template('events/show.html', event=event, form=form, available=available_tickets(event),
+                           comments_html=comments_html, pending_comments=pending_comments)
 
 # Create event method
 @event_bp.route('/create', methods = ['GET', 'POST'])
@@ -34,6 +42,7 @@ def create():
             start_time=form.start_time.data,
             end_time=form.end_time.data,
             venue=form.venue.data,
+            location=get_or_create_venue(form.venue.data, form.latitude.data, form.longitude.data),
             vendor_names=form.vendor_names.data,
             description=form.description.data,
             total_tickets=form.total_tickets.data,
@@ -61,6 +70,9 @@ def update(event_id):
     form = EventForm(obj=event, require_image=False)
     form.submit.label.text = "Update Event"
     form.event_id.data = event.id  # <-- set hidden id so validators can exclude this row
+    if request.method == 'GET' and event.location:
+        form.latitude.data = event.location.latitude
+        form.longitude.data = event.location.longitude
 
     if form.validate_on_submit():
         # Only replace image if a new file was chosen
@@ -74,6 +86,7 @@ def update(event_id):
         event.start_time = form.start_time.data
         event.end_time = form.end_time.data
         event.venue = form.venue.data
+        event.location = get_or_create_venue(form.venue.data, form.latitude.data, form.longitude.data)
         event.vendor_names = form.vendor_names.data
         event.description = form.description.data
         event.total_tickets = form.total_tickets.data
@@ -81,6 +94,7 @@ def update(event_id):
         event.free_sampling = form.free_sampling.data
         event.provide_takeaway = form.provide_takeaway.data
         event.category_type = form.category_type.data
+        event.version = Event.version + 1
 
         db.session.commit()
         flash('Successfully updated Food and Drink Festival event', 'success')
@@ -102,6 +116,7 @@ def cancel(event_id):
 
     if event.status != EventStatus.CANCELLED:
         event.status = EventStatus.CANCELLED
+        event.version = Event.version + 1
         db.session.commit()
         flash(f'The event: {event.title} has been cancelled.')
     else:
@@ -109,57 +124,135 @@ def cancel(event_id):
 
     return redirect(url_for('events.show', event_id=event.id))
 
-# Purchase tickets to generate an order, and redirect to booking history page
+# Hold tickets for the user, and redirect to the reservation page to confirm the purchase
 @event_bp.route('/<int:event_id>/purchase', methods = ['GET', 'POST'])
 @login_required
+@admission_required
 def purchase_tickets(event_id):
     event = db.session.get(Event, event_id)
     form = PurchaseTicketForm()
     if form.validate_on_submit():
+        # A resubmitted form (double click, browser or proxy retry) goes to what the first submission made
+        reservation = reservation_for_key(form.idempotency_key.data)
+        if reservation is not None:
+            # Keys are random, another user's key was not made by this form
+            if reservation.user_id != current_user.id:
+                abort(409)
+            return redirect_to_reservation(reservation)
+
         tickets = form.tickets_purchased.data
+        reservation = hold_tickets(event, current_user, tickets, form.idempotency_key.data)
 
-        if tickets > event.total_tickets:
-            flash(f'Order was unable to be booked, please enter a value less than the remaining amount of tickets. Tickets remaining: {event.total_tickets}.')
+        if reservation is None:
+            flash(f'Order was unable to be booked, please enter a value less than the remaining amount of tickets. Tickets remaining: {available_tickets(event)}.')
         else:
-            order = Order(
-                event_id=event.id,
-                user_id=current_user.id,
-                tickets_purchased=form.tickets_purchased.data,
-                purchased_amount=event.ticket_price * form.tickets_purchased.data,
-                booking_time= datetime.now()
-            )
-            event.total_tickets -= tickets
-            if event.total_tickets == 0:
-                event.status = EventStatus.SOLDOUT
-
-            db.session.add(order)
             db.session.commit()
-            flash(f'Thank you for your purchase! Your order number is #{order.id}')
-            return redirect(url_for('users.display_booking_history'))
+            flash(f'{tickets} tickets are held for you until {reservation.expires_at.strftime("%H:%M")}. Please confirm your purchase.')
+            return redirect(url_for('events.reservation', event_id=event.id, reservation_id=reservation.id))
             # Always end with redirect when form is valid
     live_status()
     return render_template('events/purchase.html', form=form, event=event)
 
+# Confirm a held reservation to generate an order, and redirect to booking history page
+@event_bp.route('/<int:event_id>/reservations/<int:reservation_id>', methods = ['GET', 'POST'])
+@login_required
+@admission_required
+def reservation(event_id, reservation_id):
+    reservation = db.session.get(Reservation, reservation_id)
+    if reservation is None or reservation.event_id != event_id or reservation.user_id != current_user.id:
+        abort(404)
+    form = ConfirmReservationForm()
+    if form.validate_on_submit():
+        if form.release.data:
+            release_reservation(reservation)
+            db.session.commit()
+            admission_store().leave(event_id, current_user.id)
+            flash('Your held tickets have been released.')
+            return redirect(url_for('events.show', event_id=event_id))
+
+        # Confirmed already, e.g. the confirm button was pressed twice
+        if reservation.status == ReservationStatus.CONFIRMED:
+            return redirect_to_reservation(reservation)
+
+        order = confirm_reservation(reservation)
+        if order is None:
+            db.session.rollback()
+            flash('Your reservation is no longer held, please reserve your tickets again.')
+            return redirect(url_for('events.purchase_tickets', event_id=event_id))
+        db.session.commit()
+        # Purchase complete, give this buyer's place to the next in the queue
+        admission_store().leave(event_id, current_user.id)
+        flash(f'Thank you for your purchase! Your order number is #{order.id}')
+        return redirect(url_for('users.display_booking_history'))
+    live_status()
+    return render_template('events/reservation.html', form=form, reservation=reservation, event=reservation.event)
+
+def redirect_to_reservation(reservation):
+    """Where a repeated purchase submission ends up: the original order, or the reservation still to confirm."""
+    if reservation.order_id:
+        flash(f'Thank you for your purchase! Your order number is #{reservation.order_id}')
+        return redirect(url_for('users.display_booking_history'))
+    return redirect(url_for('events.reservation', event_id=reservation.event_id, reservation_id=reservation.id))
+
+# Waiting room for buyers queued behind the active buyer limit
+@event_bp.route('/<int:event_id>/queue')
+@login_required
+def waiting_room(event_id):
+    require_event(event_id)
+    position = admission_store().enter(event_id, current_user.id)
+    if not position:
+        return redirect(url_for('events.purchase_tickets', event_id=event_id))
+    event = db.session.get(Event, event_id)
+    return render_template('events/queue.html', event=event, position=position)
+
+# Polled by the waiting room. Only the user lookup and the event id check touch the database
+@event_bp.route('/<int:event_id>/queue/status')
+@login_required
+def queue_status(event_id):
+    require_event(event_id)
+    position = admission_store().enter(event_id, current_user.id)
+    return jsonify(admitted=position == 0, position=position)
+
 @event_bp.route('/<int:event_id>/comment', methods = ['GET', 'POST'])
 @login_required
 def comment(event_id):
     # here the form is created form = CommentForm()
     form = CommentForm()
-    event = db.session.scalar(db.select(Event).where(Event.id==event_id))
+    event = db.session.get(Event, event_id)
+    if event is None:
+        abort(404)
     if form.validate_on_submit():
-        # read the current form
-        comment = Comment(
-            contents=form.contents.data,
-            user_id=current_user.id,
-            event=event)
-        db.session.add(comment)
-        db.session.commit()
-        flash("Your comment has been added", "success")
+        # queued and saved with other comments in one transaction, see comments.py
+        comment_batcher().submit(event.id, current_user.id, form.contents.data)
+        flash("Your comment has been received and will appear shortly", "success")
 
     # using redirect sends a GET request to destination.show
-    live_status()
     return redirect(url_for('events.show', event_id=event_id))
 
+def expire_finished_events():
+    """
+    The one status change that happens without anyone editing an event: open events that
+    have ended become INACTIVE (or SOLDOUT with no tickets left, as live_status() gives).
+    A single indexed UPDATE, run only when there is something to change.
+    """
+    now = datetime.now()
+    finished = (Event.status == EventStatus.OPEN, Event.end_time < now)
+    if db.session.scalar(db.select(Event.id).where(*finished).limit(1)) is None:
+        return
+    db.session.execute(
+        db.update(Event)
+        .where(*finished)
+        .values(
+            status=case(
+                (Event.total_tickets <= 0, literal(EventStatus.SOLDOUT, Event.status.type)),
+                else_=literal(EventStatus.INACTIVE, Event.status.type)
+            ),
+            status_date=now,
+            version=Event.version + 1
+        )
+    )
+    db.session.commit()
+
 def live_status():
     now = datetime.now()
     events = db.session.scalars(db.select(Event)).all()
@@ -177,6 +270,7 @@ def live_status():
         if event.status != new_status:
             event.status = new_status
             event.status_date = now
+            event.version += 1
 
     db.session.commit()
 
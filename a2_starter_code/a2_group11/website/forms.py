@@ -1,9 +1,9 @@
 from flask_wtf import FlaskForm
 from wtforms.fields import (
     TextAreaField, SubmitField, StringField, TelField, IntegerField, SelectField,
-    BooleanField, PasswordField, DateTimeLocalField, DecimalField, HiddenField  # <-- HiddenField added
+    BooleanField, PasswordField, DateTimeLocalField, DecimalField, HiddenField, FloatField  # <-- HiddenField added
 )
-from wtforms.validators import DataRequired, InputRequired, Length, Email, EqualTo, NumberRange
+from wtforms.validators import DataRequired, InputRequired, Length, Email, EqualTo, NumberRange, Optional
 from wtforms.validators import ValidationError  # <-- added
 from . models import EventCategory, User, Event
 from . import db
@@ -13,6 +13,7 @@ from werkzeug.utils import secure_filename
 import os
 import re  # <-- added
 from datetime import timedelta  # <-- for duration check
+from uuid import uuid4
 from sqlalchemy import func      # <-- for case-insensitive title check
 
 ALLOWED_FILE = {'PNG', 'JPG', 'JPEG', 'png', 'jpg', 'jpeg'}
@@ -262,6 +263,9 @@ class EventForm(FlaskForm):
 
     # <-- NEW: VenueSimple applied here
     venue = StringField("Venue", validators=[DataRequired(), VenueSimple()], filters=[_strip])
+    # optional venue coordinates, used for "events near me"
+    latitude = FloatField("Venue latitude (optional)", validators=[Optional(), NumberRange(min=-90, max=90)])
+    longitude = FloatField("Venue longitude (optional)", validators=[Optional(), NumberRange(min=-180, max=180)])
 
     # <-- UPDATED: use VendorNamesStrict (no digits, each >= 4 letters)
     vendor_names = StringField(
@@ -321,10 +325,17 @@ class EventForm(FlaskForm):
 
 # Purchase ticket form
 class PurchaseTicketForm(FlaskForm):
-    tickets_purchased = IntegerField(f'How many tickets would you like to purchase?', validators=[DataRequired()])
+    # new random key each time the form is shown, a resubmission of the same form sends the same key
+    idempotency_key = HiddenField(default=lambda: uuid4().hex, validators=[DataRequired(), Length(max=32)])
+    tickets_purchased = IntegerField(f'How many tickets would you like to purchase?', validators=[DataRequired(), NumberRange(min=1)])
 
-    # Submission button
+    # Submission button, tickets are held until the reservation is confirmed
+    submit = SubmitField("Reserve Tickets")
+
+# Confirm or release a ticket reservation
+class ConfirmReservationForm(FlaskForm):
     submit = SubmitField("Confirm Purchase")
+    release = SubmitField("Release Tickets")
 
 # creates the login information
 class LoginForm(FlaskForm):
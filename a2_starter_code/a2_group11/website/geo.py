@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta
+from math import asin, cos, radians, sin, sqrt
+from sqlalchemy import DDL, column, event as sa_event, func, table
+from . models import Event, EventStatus, Venue
+from . import db
+
+KM_PER_DEGREE = 111.32
+EARTH_RADIUS_KM = 6371.0
+# The R-tree stores 32-bit floats, so days are stored relative to this Julian day to keep them precise
+JULIAN_OFFSET = 2460000.0
+
+# SQLite R-tree over every event with venue coordinates: a box in
+# (latitude, longitude, day) covering the venue's point and the event's start-end interval.
+# Kept in sync with events and venues by triggers, so the ORM never writes to it.
+event_rtree = table(
+    'event_rtree',
+    column('id'), column('min_lat'), column('max_lat'), column('min_lon'), column('max_lon'),
+    column('min_day'), column('max_day'),
+)
+
+_INSERT_RTREE_ROWS = f"""
+    INSERT INTO event_rtree
+    SELECT e.id, v.latitude, v.latitude, v.longitude, v.longitude,
+           julianday(e.start_time) - {JULIAN_OFFSET}, julianday(e.end_time) - {JULIAN_OFFSET}
+    FROM events e JOIN venues v ON v.id = e.venue_id
+    WHERE v.latitude IS NOT NULL AND v.longitude IS NOT NULL AND {{where}};
+"""
+
+RTREE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS event_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon, min_day, max_day)",
+    f"""CREATE TRIGGER IF NOT EXISTS events_rtree_insert AFTER INSERT ON events BEGIN
+        {_INSERT_RTREE_ROWS.format(where='e.id = NEW.id')}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS events_rtree_update AFTER UPDATE OF venue_id, start_time, end_time ON events BEGIN
+        DELETE FROM event_rtree WHERE id = OLD.id;
+        {_INSERT_RTREE_ROWS.format(where='e.id = NEW.id')}
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS events_rtree_delete AFTER DELETE ON events BEGIN
+        DELETE FROM event_rtree WHERE id = OLD.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS venues_rtree_update AFTER UPDATE OF latitude, longitude ON venues BEGIN
+        DELETE FROM event_rtree WHERE id IN (SELECT id FROM events WHERE venue_id = NEW.id);
+        {_INSERT_RTREE_ROWS.format(where='e.venue_id = NEW.id')}
+    END""",
+]
+
+# Created and dropped with the events table by db.create_all() / db.drop_all()
+for statement in RTREE_DDL:
+    sa_event.listen(Event.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+sa_event.listen(Event.__table__, 'after_drop', DDL("DROP TABLE IF EXISTS event_rtree").execute_if(dialect='sqlite'))
+
+def _rtree_day(when):
+    """A datetime as the day number stored in the R-tree (same as SQLite's julianday() - JULIAN_OFFSET)."""
+    return (when - datetime(2000, 1, 1, 12)).total_seconds() / 86400 + 2451545.0 - JULIAN_OFFSET
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Great-circle (haversine) distance between two points."""
+    lat1, lon1, lat2, lon2 = map(radians, (lat1, lon1, lat2, lon2))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(sqrt(a))
+
+def get_or_create_venue(name, latitude=None, longitude=None):
+    """
+    Find the venue with this name (ignoring case and extra spaces), creating it if needed.
+    Coordinates, when given, are saved on the venue. The caller commits.
+    """
+    name = " ".join((name or "").split())
+    venue = db.session.scalar(db.select(Venue).where(func.lower(Venue.name) == name.lower()))
+    if venue is None:
+        venue = Venue(name=name)
+        db.session.add(venue)
+    if latitude is not None and longitude is not None:
+        venue.latitude = latitude
+        venue.longitude = longitude
+    return venue
+
+def events_near(latitude, longitude, km, days):
+    """
+    Open events within km of a point that are on at some time in the next days days,
+    nearest first. Returns a list of (event, distance in km).
+    The R-tree narrows the search to a bounding box and time window, then exact
+    distances are checked on those candidates only.
+    """
+    now = datetime.now()
+    lat_delta = km / KM_PER_DEGREE
+    lon_delta = km / (KM_PER_DEGREE * max(cos(radians(latitude)), 0.01))
+    query = (
+        db.select(Event, Venue.latitude, Venue.longitude)
+        .join(event_rtree, event_rtree.c.id == Event.id)
+        .join(Venue, Venue.id == Event.venue_id)
+        .where(
+            event_rtree.c.min_lat <= latitude + lat_delta,
+            event_rtree.c.max_lat >= latitude - lat_delta,
+            event_rtree.c.min_lon <= longitude + lon_delta,
+            event_rtree.c.max_lon >= longitude - lon_delta,
+            event_rtree.c.max_day >= _rtree_day(now),
+            event_rtree.c.min_day <= _rtree_day(now + timedelta(days=days))
+        )
+    )
+    # Only the R-tree is filtered in SQL, otherwise SQLite may prefer an events index
+    # and probe the R-tree once per event. The exact checks run on the candidates here.
+    results = []
+    for event, venue_lat, venue_lon in db.session.execute(query):
+        if event.status != EventStatus.OPEN or event.end_time <= now or event.start_time >= now + timedelta(days=days):
+            continue
+        distance = distance_km(latitude, longitude, venue_lat, venue_lon)
+        if distance <= km:
+            results.append((event, distance))
+    results.sort(key=lambda result: result[1])
+    return results
@@ -0,0 +1,302 @@
+from datetime import datetime, timedelta
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from flask import current_app, has_app_context
+from sqlalchemy import event as sa_event
+from sqlalchemy.sql import operators, visitors
+from . models import InvalidationMessage
+from . import db
+
+# How often the sqlite backend checks for messages from other workers
+POLL_SECONDS = 0.1
+# Messages older than this are deleted from the invalidations table
+KEEP_MESSAGES = timedelta(hours=1)
+# How long the redis backend waits before reconnecting after losing its connection
+RECONNECT_SECONDS = 1
+# Tables whose changes are published, the rest are never cached
+TRACKED_TABLES = {'events', 'users', 'venues', 'comments', 'orders'}
+# Entity versions remembered by each worker before the record is started again
+APPLIED_SIZE = 100000
+
+logger = logging.getLogger(__name__)
+
+class InvalidationBus:
+    """
+    Tells every cache in every worker when an entity changes.
+    Changes are collected from the SQLAlchemy session and published once the transaction
+    commits. Each message is (entity, id, version): entity is the table name, id is None
+    if the change could not be narrowed to one row, and version is the row's version
+    column as committed (Event.version), or None for tables without one or deleted rows.
+    A message for a version a worker has already applied is skipped, so duplicates and
+    late arrivals of older versions do nothing.
+    """
+
+    def __init__(self, app, backend):
+        self.app = app
+        self.backend = backend
+        # Identifies this process, so it can skip its own messages when they come back
+        self.origin = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self.lock = threading.Lock()
+        # entity -> list of callbacks(entity_id, version)
+        self.subscribers = {}
+        # (entity, id) -> highest version delivered
+        self.applied = {}
+        self.started = False
+
+    def subscribe(self, entity, callback):
+        """Call callback(entity_id, version) whenever an entity of this type changes in any worker."""
+        with self.lock:
+            self.subscribers.setdefault(entity, []).append(callback)
+
+    def start(self):
+        """Start receiving messages from other workers. Called before the first request."""
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        self.backend.start(self)
+
+    def publish(self, changes):
+        """Deliver changes to this process's caches straight away, then send them to the other workers."""
+        messages = entity_versions(sorted(changes, key=str))
+        self.deliver(messages)
+        self.backend.publish(self.origin, messages)
+
+    def deliver(self, messages):
+        for entity, entity_id, version in messages:
+            with self.lock:
+                if entity_id is not None and version is not None:
+                    if self.applied.get((entity, entity_id), 0) >= version:
+                        continue
+                    if len(self.applied) >= APPLIED_SIZE:
+                        self.applied.clear()
+                    self.applied[(entity, entity_id)] = version
+                callbacks = list(self.subscribers.get(entity, []))
+            for callback in callbacks:
+                try:
+                    callback(entity_id, version)
+                except Exception:
+                    logger.exception('Invalidation subscriber for %s failed', entity)
+
+    def deliver_all(self):
+        """Invalidate everything subscribed, for when messages may have been missed."""
+        with self.lock:
+            entities = list(self.subscribers)
+        self.deliver([(entity, None, None) for entity in entities])
+
+def entity_versions(changes):
+    """
+    Turn (entity, id) changes into (entity, id, version) messages, reading each changed
+    row's version column. Uses its own connection, as the session has just committed.
+    """
+    ids = {}
+    for entity, entity_id in changes:
+        table = db.metadata.tables.get(entity)
+        if entity_id is not None and table is not None and 'version' in table.c:
+            ids.setdefault(entity, []).append(entity_id)
+    versions = {}
+    if ids:
+        with db.engine.connect() as connection:
+            for entity, entity_ids in ids.items():
+                table = db.metadata.tables[entity]
+                for entity_id, version in connection.execute(
+                    db.select(table.c.id, table.c.version).where(table.c.id.in_(entity_ids))
+                ):
+                    versions[(entity, entity_id)] = version
+    return [(entity, entity_id, versions.get((entity, entity_id))) for entity, entity_id in changes]
+
+class MemoryBackend:
+    """Single process: messages only need delivering locally."""
+
+    def start(self, bus):
+        pass
+
+    def publish(self, origin, messages):
+        pass
+
+    def delete_old_messages(self):
+        pass
+
+class SQLitePollingBackend:
+    """
+    Workers sharing the app database: messages are rows in the invalidations table,
+    and each worker polls for rows newer than the last one it saw.
+    """
+
+    table = InvalidationMessage.__table__
+
+    def __init__(self, app, poll_seconds=POLL_SECONDS):
+        self.app = app
+        self.poll_seconds = poll_seconds
+        self.last_id = None
+
+    def start(self, bus):
+        with self.app.app_context():
+            with db.engine.connect() as connection:
+                self.last_id = connection.execute(db.select(db.func.max(self.table.c.id))).scalar() or 0
+        threading.Thread(target=self.poll, args=(bus,), daemon=True).start()
+
+    def publish(self, origin, messages):
+        rows = [{'origin': origin, 'entity': entity, 'entity_id': entity_id, 'version': version,
+                 'created_at': datetime.now()} for entity, entity_id, version in messages]
+        with db.engine.begin() as connection:
+            connection.execute(db.insert(self.table), rows)
+
+    def poll(self, bus):
+        with self.app.app_context():
+            while True:
+                time.sleep(self.poll_seconds)
+                try:
+                    with db.engine.connect() as connection:
+                        rows = connection.execute(
+                            db.select(self.table)
+                            .where(self.table.c.id > self.last_id)
+                            .order_by(self.table.c.id)
+                        ).all()
+                    if rows:
+                        self.last_id = rows[-1].id
+                        bus.deliver([(row.entity, row.entity_id, row.version) for row in rows if row.origin != bus.origin])
+                except Exception:
+                    logger.exception('Polling for invalidations failed')
+
+    def delete_old_messages(self):
+        with db.engine.begin() as connection:
+            connection.execute(db.delete(self.table).where(self.table.c.created_at < datetime.now() - KEEP_MESSAGES))
+
+class RedisBackend:
+    """Workers on any number of machines: messages go out on a Redis pub/sub channel."""
+
+    CHANNEL = 'invalidations'
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('INVALIDATION_BACKEND is "redis" but the redis package is not installed (pip install redis)')
+        self.client = redis.Redis.from_url(url)
+
+    def start(self, bus):
+        threading.Thread(target=self.listen, args=(bus,), daemon=True).start()
+
+    def publish(self, origin, messages):
+        self.client.publish(self.CHANNEL, json.dumps({'origin': origin, 'messages': messages}))
+
+    def listen(self, bus):
+        connected_before = False
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.CHANNEL)
+                if connected_before:
+                    # Messages sent while disconnected are lost, so drop everything cached
+                    bus.deliver_all()
+                connected_before = True
+                for message in pubsub.listen():
+                    data = json.loads(message['data'])
+                    if data['origin'] != bus.origin:
+                        bus.deliver([tuple(m) for m in data['messages']])
+            except Exception:
+                logger.exception('Lost the invalidation channel, reconnecting')
+                time.sleep(RECONNECT_SECONDS)
+
+    def delete_old_messages(self):
+        pass
+
+# -------- Collecting changes from the session --------
+def _pending(session):
+    return session.info.setdefault('invalidations', set())
+
+def _primary_key_values(statement, table):
+    """
+    Ids an UPDATE/DELETE is limited to, from 'id = x' or 'id IN (...)' in its WHERE clause,
+    or None if it is not limited by id.
+    """
+    if statement.whereclause is None:
+        return None
+    pk = table.primary_key.columns.values()[0]
+    for element in visitors.iterate(statement.whereclause):
+        operator = getattr(element, 'operator', None)
+        left = getattr(element, 'left', None)
+        if left is None or not left.compare(pk):
+            continue
+        right = element.right
+        if operator is operators.eq and hasattr(right, 'effective_value'):
+            return [right.effective_value]
+        if operator is operators.in_op and hasattr(right, 'effective_value'):
+            value = right.effective_value
+            # IN (subquery) values are not known here
+            if isinstance(value, (list, tuple)):
+                return list(value)
+    return None
+
+@sa_event.listens_for(db.session, 'before_flush')
+def bump_versions(session, flush_context, instances):
+    """
+    Every ORM change to a row with a version column bumps it, so its message is never
+    mistaken for one already applied. Bulk UPDATEs must set version themselves.
+    """
+    for instance in session.dirty:
+        state = db.inspect(instance)
+        if 'version' in state.mapper.columns and session.is_modified(instance) \
+                and not state.attrs.version.history.has_changes():
+            instance.version = state.mapper.class_.version + 1
+
+@sa_event.listens_for(db.session, 'after_flush')
+def collect_flushed(session, flush_context):
+    changes = _pending(session)
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        mapper = db.inspect(instance).mapper
+        if mapper.local_table.name in TRACKED_TABLES:
+            identity = mapper.primary_key_from_instance(instance)
+            changes.add((mapper.local_table.name, identity[0] if len(identity) == 1 else None))
+
+@sa_event.listens_for(db.session, 'do_orm_execute')
+def collect_bulk(orm_execute_state):
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or mapper.local_table.name not in TRACKED_TABLES:
+        return
+    table = mapper.local_table
+    ids = _primary_key_values(orm_execute_state.statement, table)
+    changes = _pending(orm_execute_state.session)
+    for entity_id in ids if ids is not None else [None]:
+        changes.add((table.name, entity_id))
+
+@sa_event.listens_for(db.session, 'after_commit')
+def publish_committed(session):
+    changes = session.info.pop('invalidations', None)
+    if changes and has_app_context():
+        bus = current_app.extensions.get('invalidation_bus')
+        if bus is not None:
+            # The transaction has committed, a failure here must not look like the write failed
+            try:
+                bus.publish(changes)
+            except Exception:
+                logger.exception('Publishing invalidations failed')
+
+@sa_event.listens_for(db.session, 'after_rollback')
+def discard_rolled_back(session):
+    session.info.pop('invalidations', None)
+
+def init_invalidation(app):
+    """Create the bus named by app.config['INVALIDATION_BACKEND']: memory, sqlite or redis."""
+    name = app.config.get('INVALIDATION_BACKEND', 'memory')
+    if name == 'memory':
+        backend = MemoryBackend()
+    elif name == 'sqlite':
+        backend = SQLitePollingBackend(app)
+    elif name == 'redis':
+        backend = RedisBackend(app.config['INVALIDATION_REDIS_URL'])
+    else:
+        raise ValueError(f'Unknown INVALIDATION_BACKEND "{name}", use memory, sqlite or redis')
+    bus = InvalidationBus(app, backend)
+    app.extensions['invalidation_bus'] = bus
+    app.before_request(bus.start)
+
+def invalidation_bus():
+    return current_app.extensions['invalidation_bus']
@@ -0,0 +1,160 @@
+from datetime import datetime, timedelta
+import logging
+import time
+import traceback
+from . models import Job, JobStatus, DeadJob, Order
+from . import db
+
+# Retry settings: a failing job is retried after 2s, 4s, 8s, 16s then dead-lettered
+MAX_ATTEMPTS = 5
+BACKOFF_SECONDS = 2
+BATCH_SIZE = 50
+POLL_INTERVAL = 1
+# A RUNNING job not finished within this many seconds is assumed lost with its worker
+LEASE_SECONDS = 300
+
+logger = logging.getLogger(__name__)
+
+# Registered job handlers, keyed by job name
+handlers = {}
+
+def job_handler(name):
+    """Register a function as the handler for jobs called name. Handlers receive the Order."""
+    def decorator(func):
+        handlers[name] = func
+        return func
+    return decorator
+
+def enqueue(name, order):
+    """
+    Queue a job for an order in the current session. Nothing is committed here, so the job
+    is saved in the same transaction as the order. Queuing the same job twice is a no-op.
+    """
+    key = f"{name}:{order.id}"
+    job = db.session.scalar(db.select(Job).where(Job.idempotency_key == key))
+    if job is None:
+        job = Job(name=name, idempotency_key=key, order_id=order.id)
+        db.session.add(job)
+    return job
+
+def claim_jobs(limit=BATCH_SIZE):
+    """Mark up to limit due jobs as RUNNING and return them. Jobs another worker claimed first are skipped."""
+    now = datetime.now()
+    ids = db.session.scalars(
+        db.select(Job.id)
+        .where(Job.status == JobStatus.PENDING, Job.run_at <= now)
+        .order_by(Job.run_at)
+        .limit(limit)
+    ).all()
+    claimed = []
+    for job_id in ids:
+        result = db.session.execute(
+            db.update(Job)
+            .where(Job.id == job_id, Job.status == JobStatus.PENDING)
+            .values(status=JobStatus.RUNNING, claimed_at=now)
+        )
+        if result.rowcount == 1:
+            claimed.append(job_id)
+    db.session.commit()
+    if not claimed:
+        return []
+    return db.session.scalars(db.select(Job).where(Job.id.in_(claimed))).all()
+
+def reclaim_expired_jobs(lease_seconds=LEASE_SECONDS):
+    """
+    Count RUNNING jobs whose lease has expired as a failed attempt, so they are retried
+    with backoff or dead-lettered. Returns how many were reclaimed.
+    """
+    now = datetime.now()
+    expired = db.session.execute(
+        db.select(Job.id, Job.claimed_at)
+        .where(Job.status == JobStatus.RUNNING, Job.claimed_at < now - timedelta(seconds=lease_seconds))
+    ).all()
+    reclaimed = 0
+    for job_id, claimed_at in expired:
+        # Take the job over first, so two workers never reclaim the same one
+        result = db.session.execute(
+            db.update(Job)
+            .where(Job.id == job_id, Job.status == JobStatus.RUNNING, Job.claimed_at == claimed_at)
+            .values(claimed_at=now)
+        )
+        db.session.commit()
+        if result.rowcount == 1:
+            fail_job(db.session.get(Job, job_id), f'Lease expired: not finished within {lease_seconds}s of {claimed_at}')
+            reclaimed += 1
+    return reclaimed
+
+def run_job(job):
+    handler = handlers.get(job.name)
+    try:
+        if handler is None:
+            raise LookupError(f'No handler registered for job "{job.name}"')
+        handler(db.session.get(Order, job.order_id))
+    except Exception:
+        db.session.rollback()
+        fail_job(job, traceback.format_exc())
+        return False
+    job.attempts += 1
+    job.status = JobStatus.DONE
+    db.session.commit()
+    return True
+
+def fail_job(job, error):
+    job.attempts += 1
+    job.last_error = error
+    if job.attempts >= MAX_ATTEMPTS:
+        job.status = JobStatus.DEAD
+        db.session.add(DeadJob(
+            job_id=job.id,
+            name=job.name,
+            idempotency_key=job.idempotency_key,
+            attempts=job.attempts,
+            error=error
+        ))
+    else:
+        # Exponential backoff before the next attempt
+        job.status = JobStatus.PENDING
+        job.run_at = datetime.now() + timedelta(seconds=BACKOFF_SECONDS * 2 ** (job.attempts - 1))
+    db.session.commit()
+
+def run_pending(limit=BATCH_SIZE):
+    """Run one batch of due jobs and return how many were processed."""
+    reclaim_expired_jobs()
+    jobs = claim_jobs(limit)
+    for job in jobs:
+        run_job(job)
+    return len(jobs)
+
+def run_worker(poll_interval=POLL_INTERVAL, periodic=()):
+    """
+    Process jobs until interrupted, logging throughput after each busy batch.
+    Functions in periodic (e.g. sweepers) are called once per loop. Errors are logged and
+    the loop carries on, so e.g. a locked database never stops the worker.
+    """
+    logger.info('Job worker started')
+    while True:
+        for task in periodic:
+            try:
+                task()
+            except Exception:
+                db.session.rollback()
+                logger.exception('Periodic task %s failed', getattr(task, '__name__', task))
+        start = time.perf_counter()
+        try:
+            processed = run_pending()
+        except Exception:
+            db.session.rollback()
+            logger.exception('Running jobs failed')
+            processed = 0
+        if processed:
+            elapsed = time.perf_counter() - start
+            logger.info('Processed %s jobs in %.3fs (%.0f jobs/s)', processed, elapsed, processed / elapsed)
+        else:
+            time.sleep(poll_interval)
+
+# -------- Post-purchase jobs --------
+@job_handler('order_confirmation')
+def send_order_confirmation(order):
+    # Stub: confirmation emails are not sent yet, the confirmation is only logged
+    logger.info('Order #%s confirmed for %s: %s tickets to %s',
+                order.id, order.user.email, order.tickets_purchased, order.event.title)
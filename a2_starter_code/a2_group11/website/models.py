@@ -20,6 +20,18 @@ class TicketType(enum.Enum):
     CHILD = "Child"
     ADULT = "Adult"
 
+class ReservationStatus(enum.Enum):
+    HELD = "Held"
+    CONFIRMED = "Confirmed"
+    RELEASED = "Released"
+    EXPIRED = "Expired"
+
+class JobStatus(enum.Enum):
+    PENDING = "Pending"
+    RUNNING = "Running"
+    DONE = "Done"
+    DEAD = "Dead"
+
 class User(db.Model, UserMixin):
     __tablename__ = "users"
     id = db.Column(db.Integer, primary_key=True)  # user's id
@@ -33,6 +45,19 @@ class User(db.Model, UserMixin):
     orders = db.relationship("Order", backref="user")
     comments = db.relationship("Comment", backref="user")
 
+# A normalised venue, shared by every event held there. Coordinates are optional.
+class Venue(db.Model):
+    __tablename__ = "venues"
+    id = db.Column(db.Integer, primary_key=True)  # venue's id
+    name = db.Column(db.String(200), unique=True, nullable=False)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+
+    events = db.relationship("Event", backref="location")
+
+    def __repr__(self):
+        return f"Name: {self.name}"
+
 class Event(db.Model):
     __tablename__ = "events"
     id = db.Column(db.Integer, primary_key=True) # event's id
@@ -51,11 +76,34 @@ class Event(db.Model):
     status = db.Column(db.Enum(EventStatus), default=EventStatus.OPEN)
     status_date = db.Column(db.DateTime, default=datetime.now)
     creator_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    # Set from venue when the event is saved, see geo.get_or_create_venue
+    venue_id = db.Column(db.Integer, db.ForeignKey("venues.id"), nullable=True)
+
+    # Denormalised counters, updated in the same transaction as each comment/order.
+    # Checked and repaired by repair_counters.py
+    comments_count = db.Column(db.Integer, default=0, server_default="0", nullable=False)
+    tickets_sold = db.Column(db.Integer, default=0, server_default="0", nullable=False, index=True)
+    revenue = db.Column(db.Numeric(10, 2), default=0, server_default="0", nullable=False)
+    # Bumped whenever the event's details, status or counters change; used for API ETags
+    version = db.Column(db.Integer, default=1, server_default="1", nullable=False)
 
     orders = db.relationship("Order", backref="event")
     comments = db.relationship("Comment", backref="event")
+    reservations = db.relationship("Reservation", backref="event")
     creator = db.relationship("User", backref="events_created")
 
+    # Indexes for the browse page filters, each ending in start_time for the default order
+    __table_args__ = (
+        db.Index("ix_events_start_time", "start_time"),
+        db.Index("ix_events_category_start_time", "category_type", "start_time"),
+        db.Index("ix_events_status_start_time", "status", "start_time"),
+        # Finds open events that have ended, see expire_finished_events()
+        db.Index("ix_events_status_end_time", "status", "end_time"),
+        db.Index("ix_events_ticket_price", "ticket_price"),
+        # Never reuse ids, archived events keep theirs
+        {"sqlite_autoincrement": True},
+    )
+
     def __repr__(self):
         return f"Name: {self.title}"
 
@@ -67,7 +115,10 @@ class Comment(db.Model):
 
     # Foreign keys -> now point to users.id / events.id
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
-    event_id = db.Column(db.Integer, db.ForeignKey("events.id"), nullable=False)
+    event_id = db.Column(db.Integer, db.ForeignKey("events.id"), nullable=False, index=True)
+
+    # Never reuse ids, archived comments keep theirs
+    __table_args__ = {"sqlite_autoincrement": True}
 
     def __repr__(self):
         return f"Name: {self.id}"
@@ -80,8 +131,157 @@ class Order(db.Model):
     purchased_amount = db.Column(Numeric(10, 2), nullable=False)
 
     # Foreign keys -> now point to users.id / events.id
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    event_id = db.Column(db.Integer, db.ForeignKey("events.id"), nullable=False, index=True)
+
+    # Key from the PurchaseTicketForm submission that created this order
+    idempotency_key = db.Column(db.String(32), unique=True, nullable=True)
+
+    # Never reuse ids, archived orders keep theirs
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    # Lets templates tell archived orders apart from current ones
+    archived = False
+
+    def __repr__(self):
+        return f"Name: {self.id}"
+
+# Tickets held for a user while they check out. Held tickets are not taken off
+# Event.total_tickets until the reservation is confirmed as an order.
+class Reservation(db.Model):
+    __tablename__ = "reservations"
+    id = db.Column(db.Integer, primary_key=True)  # reservation's id
+    quantity = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.Enum(ReservationStatus), default=ReservationStatus.HELD, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     event_id = db.Column(db.Integer, db.ForeignKey("events.id"), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey("orders.id"), nullable=True)
+    # Key from the PurchaseTicketForm submission, so a resubmitted form finds this reservation
+    idempotency_key = db.Column(db.String(32), unique=True, nullable=True)
+
+    __table_args__ = (
+        # Active holds for one event, used to work out available tickets
+        db.Index("ix_reservations_event_status_expires", "event_id", "status", "expires_at"),
+        # Expired holds, used by the sweeper
+        db.Index("ix_reservations_status_expires", "status", "expires_at"),
+    )
+
+    def __repr__(self):
+        return f"Name: {self.id}"
+
+# Server-side session data for the sqlite session backend, see sessions.py
+class SessionRecord(db.Model):
+    __tablename__ = "sessions"
+    id = db.Column(db.String(64), primary_key=True)  # session id, from the cookie
+    data = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+# Cache invalidation messages for the sqlite invalidation backend, see invalidation.py
+class InvalidationMessage(db.Model):
+    __tablename__ = "invalidations"
+    id = db.Column(db.Integer, primary_key=True)  # workers poll for ids above the last they saw
+    origin = db.Column(db.String(50), nullable=False)
+    entity = db.Column(db.String(50), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=True)
+    version = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now, nullable=False, index=True)
+
+    # Never reuse ids after old messages are deleted, or pollers would skip new ones
+    __table_args__ = {"sqlite_autoincrement": True}
+
+# Background work queued by a request (e.g. order confirmations) and run by worker.py
+class Job(db.Model):
+    __tablename__ = "jobs"
+    id = db.Column(db.Integer, primary_key=True)  # job's id
+    name = db.Column(db.String(50), nullable=False)
+    # One job per (name, order) so retried requests never queue the same work twice
+    idempotency_key = db.Column(db.String(100), unique=True, nullable=False)
+    status = db.Column(db.Enum(JobStatus), default=JobStatus.PENDING, nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    run_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    # When a worker marked the job RUNNING, so jobs left by a worker that died can be retried
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+
+    order_id = db.Column(db.Integer, db.ForeignKey("orders.id"), nullable=False, index=True)
+
+    # The worker polls for pending jobs that are due
+    __table_args__ = (db.Index("ix_jobs_status_run_at", "status", "run_at"),)
+
+    def __repr__(self):
+        return f"Name: {self.idempotency_key}"
+
+# Jobs that failed every retry, kept for inspection
+class DeadJob(db.Model):
+    __tablename__ = "dead_jobs"
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey("jobs.id"), nullable=False, index=True)
+    name = db.Column(db.String(50), nullable=False)
+    idempotency_key = db.Column(db.String(100), nullable=False)
+    attempts = db.Column(db.Integer, nullable=False)
+    error = db.Column(db.Text)
+    failed_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+
+    def __repr__(self):
+        return f"Name: {self.idempotency_key}"
+
+# ---- Archive tables ----
+# Finished events older than the retention window are moved here with their orders and
+# comments by archive.py, keeping the main tables small. Columns mirror the originals.
+class ArchivedEvent(db.Model):
+    __tablename__ = "archived_events"
+    id = db.Column(db.Integer, primary_key=True)  # same id the event had in events
+    title = db.Column(db.String(200), nullable=False)
+    image = db.Column(db.String(255), nullable=True)
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
+    venue = db.Column(db.String(200), nullable=False)
+    vendor_names = db.Column(db.String(255))
+    description = db.Column(db.Text)
+    ticket_price = db.Column(db.Numeric(10, 2), nullable=False)
+    category_type = db.Column(db.Enum(EventCategory), nullable=False)
+    status = db.Column(db.Enum(EventStatus))
+    creator_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    venue_id = db.Column(db.Integer, db.ForeignKey("venues.id"), nullable=True)
+    comments_count = db.Column(db.Integer, nullable=False)
+    tickets_sold = db.Column(db.Integer, nullable=False)
+    revenue = db.Column(db.Numeric(10, 2), nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+
+    orders = db.relationship("ArchivedOrder", backref="event")
+    comments = db.relationship("ArchivedComment", backref="event")
+
+    def __repr__(self):
+        return f"Name: {self.title}"
+
+class ArchivedOrder(db.Model):
+    __tablename__ = "archived_orders"
+    id = db.Column(db.Integer, primary_key=True)  # same id the order had in orders
+    tickets_purchased = db.Column(db.Integer, nullable=False)
+    booking_time = db.Column(db.DateTime, nullable=False)
+    purchased_amount = db.Column(Numeric(10, 2), nullable=False)
+
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True)
+    event_id = db.Column(db.Integer, db.ForeignKey("archived_events.id"), nullable=False)
+
+    # Lets templates tell archived orders apart from current ones
+    archived = True
+
+    def __repr__(self):
+        return f"Name: {self.id}"
+
+class ArchivedComment(db.Model):
+    __tablename__ = "archived_comments"
+    id = db.Column(db.Integer, primary_key=True)  # same id the comment had in comments
+    contents = db.Column(db.Text, nullable=False)
+    comment_date = db.Column(db.DateTime)
+
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    event_id = db.Column(db.Integer, db.ForeignKey("archived_events.id"), nullable=False, index=True)
 
     def __repr__(self):
         return f"Name: {self.id}"
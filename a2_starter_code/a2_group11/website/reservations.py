@@ -0,0 +1,152 @@
+from datetime import datetime, timedelta
+from sqlalchemy import func, literal
+from sqlalchemy.exc import IntegrityError
+from . models import Event, EventStatus, Order, Reservation, ReservationStatus
+from . jobs import enqueue
+from . import db
+
+# How long tickets stay held while the user checks out
+HOLD_MINUTES = 10
+# How many expired holds the sweeper releases per transaction
+SWEEP_BATCH_SIZE = 500
+
+def active_holds(event_id, now):
+    """Select the number of tickets currently held for an event."""
+    return (
+        db.select(func.coalesce(func.sum(Reservation.quantity), 0))
+        .where(
+            Reservation.event_id == event_id,
+            Reservation.status == ReservationStatus.HELD,
+            Reservation.expires_at > now
+        )
+    )
+
+def available_tickets(event):
+    """Tickets that can still be held: total_tickets minus tickets in active holds."""
+    return event.total_tickets - db.session.scalar(active_holds(event.id, datetime.now()))
+
+def reservation_for_key(idempotency_key):
+    """The reservation made by the form submission with this key, if any."""
+    return db.session.scalar(db.select(Reservation).where(Reservation.idempotency_key == idempotency_key))
+
+def hold_tickets(event, user, quantity, idempotency_key=None):
+    """
+    Hold quantity tickets for user. The availability check and the insert are a single
+    INSERT ... SELECT statement, so two buyers can never hold the same tickets.
+    Returns the new Reservation, or None if not enough tickets are available. If the user
+    already has a reservation with the same idempotency_key, that one is returned; if
+    another user's reservation has it, None is returned.
+    The caller commits.
+    """
+    now = datetime.now()
+    expires_at = now + timedelta(minutes=HOLD_MINUTES)
+    held = active_holds(Event.id, now).scalar_subquery()
+    source = (
+        db.select(
+            literal(quantity),
+            literal(ReservationStatus.HELD, Reservation.status.type),
+            literal(now, db.DateTime()),
+            literal(expires_at, db.DateTime()),
+            literal(user.id),
+            literal(idempotency_key, Reservation.idempotency_key.type),
+            Event.id
+        )
+        .where(Event.id == event.id, Event.total_tickets - held >= quantity)
+    )
+    try:
+        reservation_id = db.session.scalar(
+            db.insert(Reservation)
+            .from_select(["quantity", "status", "created_at", "expires_at", "user_id", "idempotency_key", "event_id"], source)
+            .returning(Reservation.id)
+        )
+    except IntegrityError:
+        # The same submission was processed concurrently
+        db.session.rollback()
+        reservation = reservation_for_key(idempotency_key)
+        if reservation is None or reservation.user_id != user.id:
+            return None
+        return reservation
+    if reservation_id is None:
+        return None
+    return db.session.get(Reservation, reservation_id)
+
+def confirm_reservation(reservation):
+    """
+    Turn a held reservation into an Order and take its tickets off the event.
+    Returns the Order, or None if the hold has expired or was already used. The caller commits.
+    """
+    now = datetime.now()
+    result = db.session.execute(
+        db.update(Reservation)
+        .where(
+            Reservation.id == reservation.id,
+            Reservation.status == ReservationStatus.HELD,
+            Reservation.expires_at > now
+        )
+        .values(status=ReservationStatus.CONFIRMED)
+    )
+    if result.rowcount != 1:
+        return None
+
+    event = reservation.event
+    # Update counts in SQL rather than from the loaded values, which may be stale
+    db.session.execute(
+        db.update(Event)
+        .where(Event.id == event.id)
+        .values(
+            total_tickets=Event.total_tickets - reservation.quantity,
+            tickets_sold=Event.tickets_sold + reservation.quantity,
+            revenue=Event.revenue + Event.ticket_price * reservation.quantity,
+            version=Event.version + 1
+        )
+    )
+    db.session.refresh(event)
+    if event.total_tickets == 0:
+        event.status = EventStatus.SOLDOUT
+
+    order = Order(
+        event_id=event.id,
+        user_id=reservation.user_id,
+        tickets_purchased=reservation.quantity,
+        purchased_amount=event.ticket_price * reservation.quantity,
+        booking_time=now,
+        idempotency_key=reservation.idempotency_key
+    )
+    db.session.add(order)
+    # Flush to get the order id, then queue follow-up work in the same transaction
+    db.session.flush()
+    reservation.order_id = order.id
+    enqueue('order_confirmation', order)
+    return order
+
+def release_reservation(reservation):
+    """Give held tickets back before the hold expires. The caller commits."""
+    db.session.execute(
+        db.update(Reservation)
+        .where(Reservation.id == reservation.id, Reservation.status == ReservationStatus.HELD)
+        .values(status=ReservationStatus.RELEASED)
+    )
+
+def release_expired_holds(batch_size=SWEEP_BATCH_SIZE):
+    """
+    Mark expired holds as EXPIRED, one short transaction per batch.
+    Expired holds already stop counting against availability, so this only keeps the
+    active-hold index small. Returns how many holds were released.
+    """
+    released = 0
+    while True:
+        now = datetime.now()
+        ids = db.session.scalars(
+            db.select(Reservation.id)
+            .where(Reservation.status == ReservationStatus.HELD, Reservation.expires_at <= now)
+            .limit(batch_size)
+        ).all()
+        if not ids:
+            return released
+        db.session.execute(
+            db.update(Reservation)
+            .where(Reservation.id.in_(ids), Reservation.status == ReservationStatus.HELD)
+            .values(status=ReservationStatus.EXPIRED)
+        )
+        db.session.commit()
+        released += len(ids)
@@ -0,0 +1,245 @@
+from collections import OrderedDict
+from datetime import datetime
+import secrets
+import threading
+import time
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from . models import SessionRecord
+from . import db
+
+# Sessions kept by the in-memory store before the least recently used are dropped
+MEMORY_MAX_SESSIONS = 10000
+
+# Same serializer Flask uses for cookie sessions, so the same values can be stored
+serializer = TaggedJSONSerializer()
+
+# Keys that are set and removed within one request and never saved. Flask-Login checks
+# for '_remember' after every request, this answers that without loading the session.
+REQUEST_ONLY_KEYS = {'_remember'}
+
+class ServerSideSession(SessionMixin):
+    """
+    Session whose data lives in a store, with only its id in the cookie.
+    Nothing is read from the store until the session is first used, so requests that
+    never touch the session (static files, most API calls) skip the lookup entirely.
+    """
+
+    def __init__(self, store, sid=None):
+        self.store = store
+        self.new = sid is None
+        self.sid = sid or secrets.token_urlsafe(32)
+        self._data = {} if self.new else None
+        # The logged in user when the session was loaded, to spot logins and logouts
+        self.loaded_user_id = None
+        self.modified = False
+        self.accessed = False
+
+    @property
+    def loaded(self):
+        return self._data is not None
+
+    @property
+    def data(self):
+        self.accessed = True
+        if self._data is None:
+            self._data = self.store.load(self.sid)
+            if self._data is None:
+                # Unknown or expired id, start again with a fresh one
+                self._data = {}
+                self.regenerate()
+            self.loaded_user_id = self._data.get('_user_id')
+        return self._data
+
+    @property
+    def user_changed(self):
+        return self.loaded and self._data.get('_user_id') != self.loaded_user_id
+
+    def regenerate(self):
+        """Move the session to a new random id, so an id known before a login is useless after it."""
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+
+    def __contains__(self, key):
+        if self._data is None and key in REQUEST_ONLY_KEYS:
+            return False
+        return key in self.data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self.data[key]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+# -------- Stores: load(sid), save(sid, data, lifetime), delete(sid), delete_expired() --------
+class MemorySessionStore:
+    """Least recently used sessions in this process. Only suitable for a single worker."""
+
+    def __init__(self, max_sessions=MEMORY_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self.lock = threading.Lock()
+        # sid -> (expires_at, data)
+        self.sessions = OrderedDict()
+
+    def load(self, sid):
+        with self.lock:
+            entry = self.sessions.get(sid)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self.sessions[sid]
+                return None
+            self.sessions.move_to_end(sid)
+            # Copy so changes are only kept if the session is saved
+            return serializer.loads(entry[1])
+
+    def save(self, sid, data, lifetime):
+        with self.lock:
+            self.sessions[sid] = (time.time() + lifetime.total_seconds(), serializer.dumps(data))
+            self.sessions.move_to_end(sid)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+
+    def delete(self, sid):
+        with self.lock:
+            self.sessions.pop(sid, None)
+
+    def delete_expired(self):
+        now = time.time()
+        with self.lock:
+            for sid in [sid for sid, (expires_at, _) in self.sessions.items() if expires_at <= now]:
+                del self.sessions[sid]
+
+class SQLSessionStore:
+    """
+    Sessions in the app database (the sessions table), shared by every worker.
+    Uses its own connection so saving a session never commits the request's db.session.
+    """
+
+    table = SessionRecord.__table__
+
+    def load(self, sid):
+        with db.engine.connect() as connection:
+            data = connection.execute(
+                db.select(self.table.c.data)
+                .where(self.table.c.id == sid, self.table.c.expires_at > datetime.now())
+            ).scalar()
+        return None if data is None else serializer.loads(data)
+
+    def save(self, sid, data, lifetime):
+        values = {'data': serializer.dumps(data), 'expires_at': datetime.now() + lifetime}
+        with db.engine.begin() as connection:
+            updated = connection.execute(db.update(self.table).where(self.table.c.id == sid).values(**values))
+            if updated.rowcount == 0:
+                connection.execute(db.insert(self.table).values(id=sid, **values))
+
+    def delete(self, sid):
+        with db.engine.begin() as connection:
+            connection.execute(db.delete(self.table).where(self.table.c.id == sid))
+
+    def delete_expired(self):
+        with db.engine.begin() as connection:
+            connection.execute(db.delete(self.table).where(self.table.c.expires_at <= datetime.now()))
+
+class RedisSessionStore:
+    """Sessions in Redis (or a Redis-compatible server), shared by every worker. Redis expires them itself."""
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('SESSION_BACKEND is "redis" but the redis package is not installed (pip install redis)')
+        self.client = redis.Redis.from_url(url)
+
+    def load(self, sid):
+        data = self.client.get(f'session:{sid}')
+        return None if data is None else serializer.loads(data)
+
+    def save(self, sid, data, lifetime):
+        self.client.set(f'session:{sid}', serializer.dumps(data), ex=int(lifetime.total_seconds()))
+
+    def delete(self, sid):
+        self.client.delete(f'session:{sid}')
+
+    def delete_expired(self):
+        pass
+
+class ServerSideSessionInterface(SessionInterface):
+    """Keeps session data in a store and only a signed session id in the cookie."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def signer(self, app):
+        return Signer(app.secret_key, salt='server-side-session')
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        sid = None
+        if cookie:
+            try:
+                sid = self.signer(app).unsign(cookie).decode()
+            except BadSignature:
+                pass
+        return ServerSideSession(self.store, sid)
+
+    def save_session(self, app, session, response):
+        # Never touched during this request, nothing to load or save
+        if not session.loaded:
+            return
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        # Logged in or out: drop the old id (session fixation)
+        if session.user_changed and not session.new:
+            self.store.delete(session.sid)
+            session.regenerate()
+
+        if session.modified or session.new:
+            data = {key: value for key, value in session.items() if key not in REQUEST_ONLY_KEYS}
+            self.store.save(session.sid, data, app.permanent_session_lifetime)
+        if session.new or self.should_set_cookie(app, session):
+            response.set_cookie(
+                name,
+                self.signer(app).sign(session.sid).decode(),
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+def init_sessions(app):
+    """Use the session store named by app.config['SESSION_BACKEND']: memory, sqlite or redis."""
+    backend = app.config.get('SESSION_BACKEND', 'memory')
+    if backend == 'memory':
+        store = MemorySessionStore()
+    elif backend == 'sqlite':
+        store = SQLSessionStore()
+    elif backend == 'redis':
+        store = RedisSessionStore(app.config['SESSION_REDIS_URL'])
+    else:
+        raise ValueError(f'Unknown SESSION_BACKEND "{backend}", use memory, sqlite or redis')
+    app.session_interface = ServerSideSessionInterface(store)
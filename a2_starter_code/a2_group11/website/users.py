@@ -1,5 +1,5 @@
 from flask import Blueprint, render_template, request, session, flash, redirect
-from . models import Order
+from . models import Order, ArchivedOrder
 from . import db
 from . events import live_status
 from flask_login import login_required, current_user
@@ -12,6 +12,9 @@ user_bp = Blueprint('users', __name__, url_prefix='/user')
 @login_required
 def display_booking_history():
     orders = db.session.scalars(db.select(Order).where(Order.user_id == current_user.id).order_by(desc(Order.booking_time))).all()
+    # Orders for events that have since been archived, see archive.py
+    orders += db.session.scalars(db.select(ArchivedOrder).where(ArchivedOrder.user_id == current_user.id)).all()
+    orders.sort(key=lambda order: order.booking_time, reverse=True)
     live_status()
     return render_template('userbookinghistory.html', orders=orders)
 
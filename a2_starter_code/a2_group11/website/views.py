@@ -1,14 +1,25 @@
 from flask import Blueprint, render_template, request, redirect, url_for
-from . models import Event, EventCategory
+from . models import Event
+from . browse import parse_filters, browse_events, facet_counts, PAGE_SIZE
+from . geo import events_near
 from . import db
-from . events import live_status
+from . events import live_status, expire_finished_events
 from flask_login import login_required, current_user
 
 main_bp = Blueprint('main', __name__)
 
+# Listing order chosen with ?sort=, popularity uses the denormalised Event counters so no joins are needed
+SORT_ORDERS = {
+    'upcoming': (Event.start_time,),
+    'popular': (Event.tickets_sold.desc(), Event.comments_count.desc(), Event.start_time),
+}
+
+def sort_order():
+    return SORT_ORDERS.get(request.args.get('sort'), SORT_ORDERS['upcoming'])
+
 @main_bp.route('/')
 def index():
-    events = db.session.scalars(db.select(Event).order_by(Event.start_time)).all()
+    events = db.session.scalars(db.select(Event).order_by(*sort_order())).all()
     live_status()
     return render_template('index.html', events=events, category="")
 
@@ -17,40 +28,46 @@ def search():
     if request.args['search'] and request.args['search'] != "":
         print(request.args['search'])
         query = "%" + request.args['search'] + "%"
-        events = db.session.scalars(db.select(Event).where(Event.description.like(query)).order_by(Event.start_time))
+        events = db.session.scalars(db.select(Event).where(Event.description.like(query)).order_by(*sort_order()))
         live_status()
         return render_template('index.html', events=events)
     else:
         live_status()
         return redirect(url_for('main.index'))
 
-@main_bp.route('/food')
-def food():
-    filteredevents = (db.select(Event).where(Event.category_type == EventCategory.FOOD).order_by(Event.start_time))
-    events = db.session.scalars(filteredevents).all()
-    live_status()
-    return render_template('index.html', events=events, category='Food')
-
-@main_bp.route('/drink')
-def drink():
-    filteredevents = (db.select(Event).where(Event.category_type == EventCategory.DRINK).order_by(Event.start_time))
-    events = db.session.scalars(filteredevents).all()
-    live_status()
-    return render_template('index.html', events=events, category='Drink')
+# Browse events by any combination of category, date range, sampling, takeaway, price and status
+@main_bp.route('/browse')
+def browse():
+    filters = parse_filters(request.args)
+    page = max(request.args.get('page', 1, type=int), 1)
+    # live_status() loads every event, only the time-based status change is needed here
+    expire_finished_events()
+    events = browse_events(filters, sort_order(), page)
+    facets = facet_counts(filters)
+    category = ' / '.join(c.value for c in filters['category'])
+    return render_template('index.html', events=events, category=category, filters=filters, facets=facets, page=page, page_size=PAGE_SIZE)
 
-@main_bp.route('/cultural')
-def cultural():
-    filteredevents = (db.select(Event).where(Event.category_type == EventCategory.CULTURAL).order_by(Event.start_time))
-    events = db.session.scalars(filteredevents).all()
-    live_status()
-    return render_template('index.html', events=events, category='Cultural')
+# Open events within km kilometres of lat/lon in the next days days, nearest first
+@main_bp.route('/nearby')
+def nearby():
+    latitude = request.args.get('lat', type=float)
+    longitude = request.args.get('lon', type=float)
+    if latitude is None or longitude is None:
+        return redirect(url_for('main.index'))
+    km = request.args.get('km', 10, type=float)
+    days = request.args.get('days', 7, type=int)
+    # No live_status() here, it loads every event. events_near() checks end times itself
+    results = events_near(latitude, longitude, km, days)
+    events = [event for event, _ in results]
+    distances = {event.id: distance for event, distance in results}
+    return render_template('index.html', events=events, category='Nearby', distances=distances)
 
-@main_bp.route('/dietary')
-def dietary():
-    filteredevents = (db.select(Event).where(Event.category_type == EventCategory.DIETARY).order_by(Event.start_time))
-    events = db.session.scalars(filteredevents).all()
-    live_status()
-    return render_template('index.html', events=events, category='Dietary')
+# Old single-category pages, kept so existing links still work
+@main_bp.route('/<any(food, drink, cultural, dietary):category>')
+def category(category):
+    args = request.args.to_dict(flat=False)
+    args['category'] = category.capitalize()
+    return redirect(url_for('main.browse', **args))
 
 @main_bp.route('/display_event_details')
 def display_event_details():
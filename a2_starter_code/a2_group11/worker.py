@@ -0,0 +1,16 @@
+import logging
+from website import create_app
+from website.jobs import run_worker
+from website.reservations import release_expired_holds
+from website.events import expire_finished_events
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+    app = create_app()
+    with app.app_context():
+        run_worker(periodic=[
+            release_expired_holds,
+            expire_finished_events,
+            app.session_interface.store.delete_expired,
+            app.extensions['invalidation_bus'].backend.delete_old_messages,
+        ])